@@ -22,4 +22,12 @@ class SliceListUpdateEvent(event.EventBase):
     """
     def __init__(self, slice_list):
         super(SliceListUpdateEvent, self).__init__()
-        self.slice_list=slice_list
\ No newline at end of file
+        self.slice_list=slice_list
+
+class JobProgressEvent(event.EventBase):
+    """
+    This event is used to notify the progress of a slice activation job
+    """
+    def __init__(self, job):
+        super(JobProgressEvent, self).__init__()
+        self.job=job
@@ -1,4 +1,4 @@
-from custom_events import EventTest, SliceUpdateEvent, SliceListUpdateEvent
+from custom_events import EventTest, SliceUpdateEvent, SliceListUpdateEvent, JobProgressEvent
 
 class EventsHandler(object):
     """
@@ -35,3 +35,10 @@ class EventsHandler(object):
         :param arg: event argument
         """
         self.send_event(self.to, SliceListUpdateEvent(arg))
+
+    def send_job_progress(self, arg):
+        """
+        Send a job progress event to the GUI
+        :param arg: event argument
+        """
+        self.send_event(self.to, JobProgressEvent(arg))
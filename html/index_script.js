@@ -171,6 +171,10 @@ var rpc = {
     },
     event_slice_list_update: function(slice_list){
         populate_menu(slice_list[0])
+    },
+    event_job_progress: function(job){
+        console.log("job", job[0].id, job[0].status, job[0].phase)
+        return "";
     }
 }
 function update_view(slice){
@@ -16,7 +16,6 @@
 
 import logging
 import os
-from ryu.lib import ip
 
 
 # We don't bother to use cfg.py because monkey patch needs to be
@@ -116,6 +115,8 @@ if HUB_TYPE == 'eventlet':
             assert backlog is None
             assert spawn == 'default'
 
+            # Imported here, so that the hub needs ryu only for its servers
+            from ryu.lib import ip
             if ip.valid_ipv6(listen_info[0]):
                 self.server = eventlet.listen(listen_info,
                                               family=socket.AF_INET6)
@@ -142,6 +143,7 @@ if HUB_TYPE == 'eventlet':
 
     class StreamClient(object):
         def __init__(self, addr, timeout=None, **ssl_args):
+            from ryu.lib import ip
             assert ip.valid_ipv4(addr[0]) or ip.valid_ipv6(addr[0])
             self.addr = addr
             self.timeout = timeout
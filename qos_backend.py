@@ -0,0 +1,176 @@
+"""
+QoS backend used by the switch to configure queues and QoS rules.
+
+The queues and the rules are managed by `ryu.app.rest_qos`, which needs the
+OVSDB address of each switch, set through `ryu.app.rest_conf_switch`.
+Both applications run in the same ryu process as the switch, so the
+InProcessQoSBackend calls their objects directly instead of going through
+their REST API.
+"""
+
+import logging
+import time
+import hub
+from ryu.app import conf_switch_key as cs_key
+from ryu.app import rest_qos
+from ryu.base import app_manager
+from ryu.lib import dpid as dpid_lib
+
+LOG = logging.getLogger(__name__)
+
+OVSDB_ADDR = 'tcp:127.0.0.1:6632'
+"""OVSDB address of the switches, see `ovs-vsctl set-manager` in the README"""
+
+QUEUE_TYPE = 'linux-htb'
+"""Type of the queues created on the switch ports"""
+
+QUEUE_MAX_RATE = '10000000000'
+"""Maximum rate of the port the queues are created on"""
+
+
+class InProcessQoSBackend(object):
+    """QoS backend calling the rest_qos and conf_switch objects of this ryu process
+
+    Every method configuring the switches returns the result reported by rest_qos, so that it can be logged.
+    """
+
+    def __init__(self, conf_switch):
+        """
+        Args:
+            conf_switch: The ConfSwitchSet context, shared with rest_conf_switch and rest_qos
+        """
+        super(InProcessQoSBackend, self).__init__()
+        self.conf_switch = conf_switch
+
+    def _get_qos(self, dpid):
+        """Get the rest_qos object managing a switch"""
+        qos = rest_qos.QoSController._OFS_LIST.get(dpid)
+        if qos is None:
+            raise ValueError('qos sw is not connected. : switchID=%s' % dpid_lib.dpid_to_str(dpid))
+        return qos
+
+    def _get_waiters(self):
+        """Get the dictionary rest_qos uses to wait for the flow stats replies"""
+        app = app_manager.lookup_service_brick('RestQoSAPI')
+        if app is None:
+            raise ValueError('ryu.app.rest_qos is not running')
+        return app.waiters
+
+    def _call(self, dpid, func, *args):
+        """Call a rest_qos command on a switch, reporting errors like the REST API does"""
+        try:
+            return getattr(self._get_qos(dpid), func)(*args)
+        except ValueError as e:
+            LOG.error('QoS %s failed on switch %s: %s', func, dpid_lib.dpid_to_str(dpid), e)
+            return {rest_qos.REST_SWITCHID: dpid_lib.dpid_to_str(dpid),
+                    rest_qos.REST_COMMAND_RESULT: {'result': 'failure', 'details': str(e)}}
+
+    def set_ovsdb_addr(self, dpid, ovsdb_addr=OVSDB_ADDR):
+        """Set the OVSDB address of a switch, needed to create queues on it
+
+        Args:
+            dpid: The datapath ID of the switch
+            ovsdb_addr: The OVSDB address of the switch
+
+        Returns:
+            Whether the address is set
+        """
+        # Connect rest_qos to OVSDB right away, then record the address like
+        # rest_conf_switch does (rest_qos ignores the event for a known address)
+        try:
+            self._get_qos(dpid).set_ovsdb_addr(dpid, ovsdb_addr)
+        except ValueError as e:
+            LOG.error('Setting the OVSDB address of switch %s failed: %s', dpid_lib.dpid_to_str(dpid), e)
+            return False
+        self.conf_switch.set_key(dpid, cs_key.OVSDB_ADDR, ovsdb_addr)
+        return True
+
+    def is_ready(self, dpid):
+        """Check whether queues can be created on a switch, i.e. rest_qos is connected to its OVSDB
+
+        Args:
+            dpid: The datapath ID of the switch
+        """
+        qos = rest_qos.QoSController._OFS_LIST.get(dpid)
+        return qos is not None and qos.ovs_bridge is not None
+
+    def wait_ready(self, dpid, timeout, interval=0.05):
+        """Wait until queues can be created on a switch, see is_ready
+
+        Args:
+            dpid: The datapath ID of the switch
+            timeout: Maximum number of seconds to wait
+            interval: Number of seconds between two checks
+
+        Returns:
+            Whether the switch is ready
+        """
+        deadline = time.time() + timeout
+        while not self.is_ready(dpid):
+            if time.time() >= deadline:
+                return False
+            hub.sleep(interval)
+        return True
+
+    def set_queue(self, dpid, port_name, queues):
+        """Create the queues on a port of a switch
+
+        Args:
+            dpid: The datapath ID of the switch
+            port_name: The name of the port, e.g. s1-eth5
+            queues: The list of queues, as dictionaries with a max_rate
+        """
+        return self._call(dpid, 'set_queue', self._queue_config(port_name, queues), rest_qos.VLANID_NONE)
+
+    def delete_queue(self, dpid):
+        """Delete the queues of a switch
+
+        Args:
+            dpid: The datapath ID of the switch
+        """
+        return self._call(dpid, 'delete_queue', {}, rest_qos.VLANID_NONE)
+
+    def add_rule(self, dpid, match, queue):
+        """Add a QoS rule sending the matching packets to a queue
+
+        Args:
+            dpid: The datapath ID of the switch
+            match: The match of the rule, with nw_src and nw_dst
+            queue: The ID of the queue
+        """
+        return self._call(dpid, 'set_qos', self._rule_config(match, queue), rest_qos.VLANID_NONE,
+                          self._get_waiters())
+
+    def delete_rules(self, dpid=None):
+        """Delete the QoS rules of a switch
+
+        Args:
+            dpid: The datapath ID of the switch, None to delete the rules of every switch
+        """
+        dpids = [dpid] if dpid is not None else list(rest_qos.QoSController._OFS_LIST.keys())
+        return [self._call(dpid, 'delete_qos', {rest_qos.REST_QOS_ID: rest_qos.REST_ALL},
+                           rest_qos.REST_ALL, self._get_waiters())
+                for dpid in dpids]
+
+    @staticmethod
+    def _queue_config(port_name, queues):
+        """Build the rest_qos queue configuration of a port"""
+        return {
+            "port_name": port_name,
+            "type": QUEUE_TYPE,
+            "max_rate": QUEUE_MAX_RATE,
+            "queues": [{"max_rate": queue["max_rate"]} for queue in queues]
+        }
+
+    @staticmethod
+    def _rule_config(match, queue):
+        """Build the rest_qos rule configuration"""
+        return {
+            "match": {
+                "nw_dst": match["nw_dst"],
+                "nw_src": match["nw_src"],
+            },
+            "actions": {
+                "queue": queue,
+            }
+        }
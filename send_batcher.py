@@ -0,0 +1,83 @@
+"""
+Coalescing of the OpenFlow messages sent to the switches.
+
+Applying a slice, recalculating the spanning tree or flushing the flows sends
+dozens of small messages to each switch, and ryu writes every one of them to
+the socket on its own. The SendBatcher of a switch collects the messages sent
+to it until the current greenthread yields, then writes them at once: the
+order of the messages is kept, only the number of socket writes changes.
+"""
+
+import logging
+import hub
+
+LOG = logging.getLogger(__name__)
+
+
+class SendBatcher(object):
+    """Coalesce the messages sent to a switch during a hub tick into a single socket write"""
+
+    def __init__(self, datapath):
+        """
+        Args:
+            datapath: The switch, whose send method is replaced, see install
+        """
+        super(SendBatcher, self).__init__()
+        self.datapath = datapath
+        self._send = datapath.send
+        self._bufs = []
+        self.messages = 0
+        """Number of messages sent to the switch"""
+        self.writes = 0
+        """Number of buffers handed to the switch connection, one per batch"""
+
+    @classmethod
+    def install(cls, datapath):
+        """Make every message sent to a switch go through a SendBatcher
+
+        Both Datapath.send_msg and Datapath.send_packet_out end up in Datapath.send,
+        so the messages of every application (STP, slices, QoS) are coalesced.
+
+        Args:
+            datapath: The switch
+
+        Returns:
+            The SendBatcher of the switch
+        """
+        batcher = getattr(datapath.send, '__self__', None)
+        if isinstance(batcher, cls):
+            return batcher
+        batcher = cls(datapath)
+        datapath.send = batcher.send
+        return batcher
+
+    def send(self, buf, close_socket=False):
+        """Queue a serialized message, written with the others of the same hub tick
+
+        Args:
+            buf: The serialized message
+            close_socket: Whether to close the connection once the message is written
+
+        Returns:
+            Whether the message is queued, False if the connection is terminating
+        """
+        if self.datapath.send_q is None:
+            return self._send(buf, close_socket)
+        self.messages += 1
+        if close_socket:
+            self.flush()
+            return self._send(buf, close_socket)
+        if not self._bufs:
+            hub.spawn(self.flush)
+        self._bufs.append(buf)
+        return True
+
+    def flush(self):
+        """Write the queued messages at once"""
+        if not self._bufs:
+            return
+        bufs, self._bufs = self._bufs, []
+        self.writes += 1
+        if not self._send(b''.join(bufs)):
+            LOG.debug('Dropped %d messages to switch %s, its connection is terminating',
+                      len(bufs), self.datapath.id)
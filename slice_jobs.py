@@ -0,0 +1,168 @@
+"""
+Asynchronous jobs applying slices to the network.
+
+Activating or deactivating a slice takes seconds (QoS, flows, spanning tree).
+Instead of holding the HTTP request for the whole time, a job is submitted and
+its ID returned right away. Jobs are executed one at a time, in the order they
+were submitted, by a single greenthread: two activations never interleave.
+Deleting a slice template is a job too, so that it does not shift the slices
+of the jobs still pending.
+Every phase of a job is timed and reported through a callback, so that the
+progress can be pushed to the GUI.
+"""
+
+import collections
+import itertools
+import logging
+import time
+import hub
+
+LOG = logging.getLogger(__name__)
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+MAX_JOBS = 100
+"""Number of finished jobs kept, to be queried through the REST API"""
+
+
+class Job(object):
+    """A slice activation or deactivation, executed by the JobManager"""
+
+    def __init__(self, job_id, kind, func, args, slice_index=None):
+        """
+        Args:
+            job_id: The ID of the job
+            kind: The kind of job, e.g. activate, deactivate or delete
+            func: The function executing the job, called with args and the progress function
+            args: The arguments of func
+            slice_index: The index of the slice template the job applies, if any
+        """
+        self.id = job_id
+        self.kind = kind
+        self.slice_index = slice_index
+        self.func = func
+        self.args = args
+        self.status = JOB_PENDING
+        self.phase = None
+        self.phases = []
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self._phase_started = None
+        self._done = hub.Event()
+
+    def start_phase(self, phase):
+        """End the current phase of the job and start a new one"""
+        now = time.time()
+        if self.phase is not None:
+            self.phases.append({"phase": self.phase, "duration": now - self._phase_started})
+        self.phase = phase
+        self._phase_started = now
+
+    def wait(self, timeout=None):
+        """Wait until the job is done or failed
+
+        Returns:
+            Whether the job is finished
+        """
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        """Get the JSON representation of the job"""
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "slice": self.slice_index,
+            "status": self.status,
+            "phase": self.phase,
+            "phases": list(self.phases),
+            "error": self.error,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class JobManager(object):
+    """Execute the submitted jobs one at a time, in a dedicated greenthread"""
+
+    def __init__(self, on_update=None):
+        """
+        Args:
+            on_update: Function called with the job every time its status or phase changes
+        """
+        super(JobManager, self).__init__()
+        self.on_update = on_update
+        self.jobs = collections.OrderedDict()
+        self._ids = itertools.count(1)
+        self._queue = hub.Queue()
+        self._thread = hub.spawn(self._run)
+
+    def submit(self, kind, func, *args, **kwargs):
+        """Queue a job
+
+        Args:
+            kind: The kind of job, e.g. activate, deactivate or delete
+            func: The function executing the job. It is called with args and a progress keyword
+                argument, a function to call with the name of every phase it starts
+            args: The arguments of func
+            slice_index: The index of the slice template the job applies, if any
+
+        Returns:
+            The Job
+        """
+        job = Job(next(self._ids), kind, func, args, kwargs.get('slice_index'))
+        self.jobs[job.id] = job
+        self._prune()
+        self._notify(job)
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id):
+        """Get a job from its ID, None if it does not exist (anymore)"""
+        return self.jobs.get(job_id)
+
+    def _prune(self):
+        """Forget the oldest finished jobs once there are more than MAX_JOBS"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in (JOB_DONE, JOB_FAILED)]
+        for job_id in finished[:len(self.jobs) - MAX_JOBS]:
+            del self.jobs[job_id]
+
+    def _notify(self, job):
+        """Report a change of the job"""
+        if self.on_update is not None:
+            try:
+                self.on_update(job)
+            except Exception:
+                LOG.exception('Reporting the progress of job %d failed', job.id)
+
+    def _run(self):
+        """Execute the jobs as they are submitted"""
+        while True:
+            job = self._queue.get()
+            self._execute(job)
+
+    def _execute(self, job):
+        """Execute a job, recording its phases"""
+
+        def progress(phase):
+            job.start_phase(phase)
+            self._notify(job)
+
+        job.status = JOB_RUNNING
+        job.started = time.time()
+        try:
+            job.func(*job.args, progress=progress)
+            job.status = JOB_DONE
+        except Exception as e:
+            LOG.exception('Job %d (%s) failed', job.id, job.kind)
+            job.status = JOB_FAILED
+            job.error = str(e)
+        job.start_phase(None)
+        job.finished = time.time()
+        self._notify(job)
+        job._done.set()
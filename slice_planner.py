@@ -0,0 +1,104 @@
+"""
+Planning of the transitions between slices.
+
+Moving from a slice to another one only needs to touch what differs between them:
+the ports to enable or disable on each switch, and the queues and QoS rules of the
+switches whose QoS configuration changed. The functions of this module compute
+these differences, the switch application executes them.
+"""
+
+import collections
+
+PortChanges = collections.namedtuple('PortChanges', ['enable', 'disable'])
+"""Ports to enable and to disable on a switch, as sorted lists of port numbers"""
+
+QoSChanges = collections.namedtuple('QoSChanges', ['old', 'new', 'queues', 'rules'])
+"""QoS configurations of a switch before and after a transition, and whether its queues
+and its rules have to be replaced"""
+
+
+def slice_ports(slice_table):
+    """Get the ports used by a slice on each switch
+
+    A port is used if packets can enter or leave the switch through it.
+
+    Args:
+        slice_table: The compiled slice configuration, dpid -> in_port -> SliceEntry
+
+    Returns:
+        A dictionary dpid -> set of port numbers
+    """
+
+    ports = {}
+    for dpid, port_table in slice_table.items():
+        used = ports.setdefault(dpid, set())
+        for in_port, entry in port_table.items():
+            used.add(in_port)
+            used.update(entry.out_ports)
+    return ports
+
+
+def plan_port_changes(port_states, target_ports=None):
+    """Compute the ports to enable and disable to reach the target ports
+
+    Args:
+        port_states: The current state of the ports, dpid -> port number -> whether it is enabled
+        target_ports: The ports to have enabled, dpid -> set of port numbers,
+            None to have every port enabled
+
+    Returns:
+        A dictionary dpid -> PortChanges, with only the switches having ports to change
+    """
+
+    changes = {}
+    for dpid, states in port_states.items():
+        target = None if target_ports is None else target_ports.get(dpid, ())
+        enable = []
+        disable = []
+        for port_no, enabled in states.items():
+            wanted = target is None or port_no in target
+            if wanted and not enabled:
+                enable.append(port_no)
+            elif enabled and not wanted:
+                disable.append(port_no)
+        if enable or disable:
+            changes[dpid] = PortChanges(sorted(enable), sorted(disable))
+    return changes
+
+
+def _queues_key(qos):
+    """Get a comparable representation of the queues of QoS configurations"""
+    return sorted((conf["port_name"], tuple(queue["max_rate"] for queue in conf["queues"]))
+                  for conf in qos)
+
+
+def _rules_key(qos):
+    """Get a comparable representation of the rules of QoS configurations"""
+    return sorted((match["nw_src"], match["nw_dst"], conf["queues"][index]["queue"])
+                  for conf in qos for index, match in enumerate(conf["match"]))
+
+
+def plan_qos_changes(old_qos, new_qos):
+    """Compute the switches whose queues or QoS rules have to be replaced
+
+    rest_qos deletes the queues and the rules of a switch all at once, so a switch with
+    any difference gets all its queues (or all its rules) replaced. The queue IDs only
+    depend on the position of the queues, so the rules are kept when only the rates change.
+
+    Args:
+        old_qos: The QoS configurations currently applied, dpid -> list of configurations
+        new_qos: The QoS configurations to apply, dpid -> list of configurations
+
+    Returns:
+        A dictionary dpid -> QoSChanges, with only the switches having something to change
+    """
+
+    changes = {}
+    for dpid in set(old_qos) | set(new_qos):
+        old = old_qos.get(dpid, [])
+        new = new_qos.get(dpid, [])
+        queues = _queues_key(old) != _queues_key(new)
+        rules = _rules_key(old) != _rules_key(new)
+        if queues or rules:
+            changes[dpid] = QoSChanges(old, new, queues, rules)
+    return changes
@@ -14,20 +14,24 @@
 # limitations under the License.
 
 
+import collections
 import datetime
+import heapq
 import logging
+import struct
 
 from ryu.base import app_manager
 from ryu.controller import event
 from ryu.controller import handler
 from ryu.controller import ofp_event
 from ryu.controller.handler import set_ev_cls
-from ryu.exception import RyuException
 from ryu.exception import OFPUnknownVersion
 import hub
+from timer_scheduler import TimerScheduler
 from ryu.lib import mac
 from ryu.lib.dpid import dpid_to_str
 from ryu.lib.packet import bpdu
+from ryu.lib.packet import ether_types
 from ryu.lib.packet import ethernet
 from ryu.lib.packet import llc
 from ryu.lib.packet import packet
@@ -43,6 +47,45 @@ BPDU_PKT_IN_PRIORITY = 0xffff
 NO_PKT_IN_PRIORITY = 0xfffe
 
 
+# Ethernet header (destination, source, ethertype or 802.3 length)
+# and the LLC DSAP/SSAP carried by BPDUs.
+ETH_HEADER = struct.Struct('!6s6sH')
+BPDU_DST_ADDRESS = mac.haddr_to_bin(bpdu.BRIDGE_GROUP_ADDRESS)
+BPDU_LLC_SAP = struct.pack('!BB', llc.SAP_BPDU, llc.SAP_BPDU)
+
+# Fields patched in the Config BPDU templates of the ports:
+# the flags and the message age (in 1/256 seconds).
+BPDU_OFFSET = (ETH_HEADER.size + llc.llc._PACK_LEN
+               + llc.ControlFormatU._PACK_LEN)
+BPDU_FLAGS_OFFSET = BPDU_OFFSET + bpdu.bpdu._PACK_LEN
+BPDU_MESSAGE_AGE_OFFSET = BPDU_FLAGS_OFFSET + struct.calcsize('!BQIQH')
+BPDU_TIMER = struct.Struct('!H')
+
+
+# Ethernet header decoded by the PacketIn fast path.
+# MAC addresses are strings formatted like ryu.lib.packet.ethernet does.
+EthernetHeader = collections.namedtuple('EthernetHeader',
+                                        ['dst', 'src', 'ethertype'])
+
+
+def parse_ethernet_header(data):
+    """ Decode the Ethernet header of a frame without parsing
+         the upper layers. Return None if the frame is truncated. """
+    if len(data) < ETH_HEADER.size:
+        return None
+    dst, src, ethertype = ETH_HEADER.unpack_from(data)
+    return EthernetHeader(dst.hex(':'), src.hex(':'), ethertype)
+
+
+def is_bpdu_frame(data):
+    """ Check the destination address and the LLC header,
+         which is enough to tell BPDUs from data frames. """
+    dst, _src, length = ETH_HEADER.unpack_from(data)
+    return (dst == BPDU_DST_ADDRESS
+            and length <= ether_types.ETH_TYPE_IEEE802_3
+            and data[ETH_HEADER.size:ETH_HEADER.size + 2] == BPDU_LLC_SAP)
+
+
 # Result of compared config BPDU priority.
 SUPERIOR = -1
 REPEATED = 0
@@ -52,6 +95,9 @@ INFERIOR = 1
 DESIGNATED_PORT = 0  # The port which sends BPDU.
 ROOT_PORT = 1  # The port which receives BPDU from a root bridge.
 NON_DESIGNATED_PORT = 2  # The port which blocked.
+ALTERNATE_PORT = 3  # (RSTP) Blocked, alternate path to the root bridge.
+BACKUP_PORT = 4  # (RSTP) Blocked, backup of a port of the same bridge.
+BLOCKED_PORT_ROLES = (NON_DESIGNATED_PORT, ALTERNATE_PORT, BACKUP_PORT)
 
 """ How to decide the port roles.
 
@@ -80,9 +126,37 @@ NON_DESIGNATED_PORT = 2  # The port which blocked.
        it is determined by the cost of the path, etc.
      NON_DESIGNATED_PORT(ND):
        the port other than a ROOT_PORT and DESIGNATED_PORT.
+     ALTERNATE_PORT(A) / BACKUP_PORT(B):
+       (RSTP) a NON_DESIGNATED_PORT receiving BPDUs from another
+       bridge / from a port of the same bridge.
 """
 
 
+# Spanning tree protocol of a bridge, see Stp.set_config().
+PROTOCOL_STP = 'stp'
+PROTOCOL_RSTP = 'rstp'
+PROTOCOL_CENTRALIZED = 'centralized'
+
+# RST BPDU flags.
+RSTP_FLAG_TC = 0x01
+RSTP_FLAG_PROPOSAL = 0x02
+RSTP_FLAG_LEARNING = 0x10
+RSTP_FLAG_FORWARDING = 0x20
+RSTP_FLAG_AGREEMENT = 0x40
+RSTP_FLAG_TCA = 0x80
+# Flags of the BPDUs which are always parsed, see Port.rcv_repeated_bpdu().
+BPDU_PARSED_FLAGS = RSTP_FLAG_TC | RSTP_FLAG_PROPOSAL | RSTP_FLAG_TCA
+RSTP_ROLE_SHIFT = 2
+RSTP_ROLE_MASK = 0x03 << RSTP_ROLE_SHIFT
+RSTP_ROLE_ALTERNATE_BACKUP = 0x01
+RSTP_ROLE_ROOT = 0x02
+RSTP_ROLE_DESIGNATED = 0x03
+
+# Number of hello times without BPDU after which
+#  a DESIGNATED_PORT becomes an edge port.
+EDGE_DELAY = 3
+
+
 # Port state
 #  DISABLE: Administratively down or link down by an obstacle.
 #  BLOCK  : Not part of spanning tree.
@@ -143,15 +217,36 @@ PORT_CONFIG_V1_3 = {PORT_STATE_DISABLE: (ofproto_v1_3.OFPPC_NO_RECV
        except port configuration is disable.
       If port configuration is disable or link down occurred,
        the port state is set to [DISABLE]
+
+    RSTP (see Stp.set_config()):
+      ROOT_PORT goes to [FORWARD] right away.
+      ALTERNATE_PORT and BACKUP_PORT go to [BLOCK] right away.
+      DESIGNATED_PORT starts in [LISTEN] and sends proposals. It goes
+       to [FORWARD] as soon as the other end sends an agreement,
+       otherwise after the timers above.
+      A port receiving legacy Config BPDUs falls back to STP.
+
+    Centralized (see Stp.set_links()):
+      No BPDU nor timer. Ports are in [BLOCK] until the tree is computed,
+       then ROOT_PORT and DESIGNATED_PORT are set to [FORWARD],
+       the other ports to [BLOCK].
+      A DESIGNATED_PORT without known link may be connected to a bridge
+       not discovered yet: it stays in [LISTEN] until its link is known,
+       or until it is found to be an edge port (see Port.set_edge()).
 """
 
 
 # Throw this event when network topology is changed.
 # Flush filtering database, when you receive this event.
+# 'port_nos' are the ports whose learned addresses may be stale:
+# a port that stopped forwarding, or every port but the one that
+# started forwarding or that a topology change was received on.
+# None when the whole database is stale.
 class EventTopologyChange(event.EventBase):
-    def __init__(self, dp):
+    def __init__(self, dp, port_nos=None):
         super(EventTopologyChange, self).__init__()
         self.dp = dp
+        self.port_nos = port_nos
 
 
 # Throw this event when port status is changed.
@@ -164,10 +259,13 @@ class EventPortStateChange(event.EventBase):
 
 
 # Event for receive packet in message except BPDU packet.
+# 'eth' is the EthernetHeader decoded by the fast path, so that
+# observers don't need to parse the packet again.
 class EventPacketIn(event.EventBase):
-    def __init__(self, msg):
+    def __init__(self, msg, eth=None):
         super(EventPacketIn, self).__init__()
         self.msg = msg
+        self.eth = eth
 
 
 # For Python3 compatibility
@@ -177,6 +275,175 @@ def cmp(a, b):
     return (a > b) - (a < b)
 
 
+def compute_spanning_tree(bridges, links):
+    """ Compute the spanning tree of bridges from the links between them,
+         as 802.1D would: the bridge with the smallest bridge ID is the
+         root, the ROOT_PORT of the other bridges is on the least cost
+         path to it (ties broken by designated bridge ID, designated
+         port ID and port ID), the end sending the best BPDU of each link
+         is its DESIGNATED_PORT and the other end is blocked.
+        Ports without link (e.g. to hosts) are DESIGNATED_PORT.
+
+        bridges: {<dpid>: Bridge}
+        links: iterable of ((<dpid>, <port_no>), (<dpid>, <port_no>))
+        Return {<dpid>: {<port_no>: <role>}} for the enabled ports. """
+    def enabled_port(dpid, port_no):
+        bridge = bridges.get(dpid)
+        port = bridge.ports.get(port_no) if bridge is not None else None
+        if port is None or port.state is PORT_STATE_DISABLE:
+            return None
+        return port
+
+    # Links with both ends enabled, in both directions.
+    peers = {}
+    for src, dst in links:
+        if (src != dst and enabled_port(*src) is not None
+                and enabled_port(*dst) is not None):
+            peers[src] = dst
+            peers[dst] = src
+    neighbors = dict((dpid, []) for dpid in bridges)
+    for src, dst in peers.items():
+        neighbors[src[0]].append((src[1], dst))
+
+    # Least cost paths to the root bridge of each connected part.
+    root_path_cost = {}
+    root_port = {}
+    while len(root_path_cost) < len(bridges):
+        root = min((dpid for dpid in bridges if dpid not in root_path_cost),
+                   key=lambda dpid: bridges[dpid].bridge_id.value)
+        heap = [(0, 0, 0, 0, root, None)]
+        while heap:
+            cost, _bid, _pid, _port_id, dpid, port_no = heapq.heappop(heap)
+            if dpid in root_path_cost:
+                continue
+            root_path_cost[dpid] = cost
+            root_port[dpid] = port_no
+            bridge = bridges[dpid]
+            for src_port_no, (dst_dpid, dst_port_no) in neighbors[dpid]:
+                if dst_dpid in root_path_cost:
+                    continue
+                src_port = bridge.ports[src_port_no]
+                dst_port = bridges[dst_dpid].ports[dst_port_no]
+                heapq.heappush(heap, (cost + src_port.path_cost,
+                                      bridge.bridge_id.value,
+                                      src_port.port_id.value,
+                                      dst_port.port_id.value,
+                                      dst_dpid, dst_port_no))
+
+    def bpdu_priority(dpid, port_no):
+        port = bridges[dpid].ports[port_no]
+        return (root_path_cost[dpid] + port.path_cost,
+                bridges[dpid].bridge_id.value, port.port_id.value)
+
+    port_roles = {}
+    for dpid, bridge in bridges.items():
+        roles = port_roles.setdefault(dpid, {})
+        for port_no in bridge.ports:
+            if enabled_port(dpid, port_no) is None:
+                continue
+            peer = peers.get((dpid, port_no))
+            if peer is None:
+                roles[port_no] = DESIGNATED_PORT
+            elif port_no == root_port[dpid]:
+                roles[port_no] = ROOT_PORT
+            elif bpdu_priority(dpid, port_no) < bpdu_priority(*peer):
+                roles[port_no] = DESIGNATED_PORT
+            elif peer[0] == dpid:
+                roles[port_no] = BACKUP_PORT
+            else:
+                roles[port_no] = ALTERNATE_PORT
+    return port_roles
+
+
+def compute_loop_free_tree(bridges, links, enabled_ports=None):
+    """ Compute the spanning tree of bridges whose enabled ports make
+         no loop, so that every enabled port is forwarding: the ROOT_PORT
+         of each bridge is on the path to the bridge with the smallest
+         bridge ID, the other ports are DESIGNATED_PORT. The ports hold
+         the information they would receive in BPDUs once converged.
+        Every enabled port must be an edge port or have a known link:
+         a port without known link may lead to a bridge not discovered
+         yet, which could close a loop.
+
+        bridges: {<dpid>: Bridge}
+        links: iterable of ((<dpid>, <port_no>), (<dpid>, <port_no>))
+        enabled_ports: {<dpid>: set of <port_no>}, None for every port
+        Return {<dpid>: BridgeTree} to give to Bridge.restore_tree(),
+         None if the links between the enabled ports make a loop or
+         an enabled port is neither an edge port nor linked. """
+    def enabled_port(dpid, port_no):
+        bridge = bridges.get(dpid)
+        if bridge is None or port_no not in bridge.ports:
+            return False
+        link_down = bridge.ports_state[port_no] & 0b1
+        return bool(bridge.ports[port_no].config_enable and not link_down
+                    and (enabled_ports is None
+                         or port_no in enabled_ports.get(dpid, ())))
+
+    peers = {}
+    linked_ports = set()
+    for src, dst in links:
+        linked_ports.update((src, dst))
+        if src != dst and enabled_port(*src) and enabled_port(*dst):
+            peers[src] = dst
+            peers[dst] = src
+    for dpid, bridge in bridges.items():
+        for port_no, port in bridge.ports.items():
+            if (enabled_port(dpid, port_no) and not port.edge
+                    and (dpid, port_no) not in linked_ports):
+                return None
+    neighbors = dict((dpid, []) for dpid in bridges)
+    for src, dst in sorted(peers.items()):
+        neighbors[src[0]].append((src[1], dst))
+
+    # Breadth-first from the root bridge of each connected part:
+    #  {<dpid>: (<root port_no>, <root priority>, <root times>)}
+    tree_info = {}
+    for root in sorted(bridges, key=lambda dpid: bridges[dpid].bridge_id.value):
+        if root in tree_info:
+            continue
+        bridge = bridges[root]
+        tree_info[root] = (None, Priority(bridge.bridge_id, 0, None, None),
+                           bridge.bridge_times)
+        queue = collections.deque([root])
+        while queue:
+            dpid = queue.popleft()
+            bridge = bridges[dpid]
+            root_port_no, priority, times = tree_info[dpid]
+            for port_no, (peer_dpid, peer_port_no) in neighbors[dpid]:
+                if port_no == root_port_no:
+                    continue
+                if peer_dpid in tree_info:
+                    # Reached twice: there is a loop.
+                    return None
+                # The BPDU sent by the port, see Port._generate_config_bpdu()
+                port = bridge.ports[port_no]
+                tree_info[peer_dpid] = (
+                    peer_port_no,
+                    Priority(priority.root_id,
+                             priority.root_path_cost + port.path_cost,
+                             bridge.bridge_id, port.port_id),
+                    times._replace(message_age=times.message_age + 1))
+                queue.append(peer_dpid)
+
+    trees = {}
+    for dpid, bridge in bridges.items():
+        root_port_no, root_priority, root_times = tree_info[dpid]
+        ports = {}
+        for port_no in bridge.ports:
+            if not enabled_port(dpid, port_no):
+                ports[port_no] = PortTree(DESIGNATED_PORT, PORT_STATE_DISABLE,
+                                          None, None)
+            elif port_no == root_port_no:
+                ports[port_no] = PortTree(ROOT_PORT, PORT_STATE_FORWARD,
+                                          root_priority, root_times)
+            else:
+                ports[port_no] = PortTree(DESIGNATED_PORT, PORT_STATE_FORWARD,
+                                          None, None)
+        trees[dpid] = BridgeTree(root_priority, root_times, ports)
+    return trees
+
+
 class Stp(app_manager.RyuApp):
     """ STP(spanning tree) library. """
 
@@ -190,10 +457,16 @@ class Stp(app_manager.RyuApp):
         self._set_logger()
         self.config = {}
         self.bridge_list = {}
+        self.links = set()
+        # Converged spanning trees, by port mask. See save_tree().
+        self.trees = {}
+        # Timers of the ports of every bridge
+        self.scheduler = TimerScheduler(self.logger)
 
     def close(self):
-        for dpid in self.bridge_list:
+        for dpid in list(self.bridge_list):
             self._unregister_bridge(dpid)
+        self.scheduler.stop()
 
     def _set_logger(self):
         self.logger.propagate = False
@@ -211,10 +484,12 @@ class Stp(app_manager.RyuApp):
                                            'sys_ext_id': <value>,
                                            'max_age': <value>,
                                            'hello_time': <value>,
-                                           'fwd_delay': <value>}
+                                           'fwd_delay': <value>,
+                                           'protocol': <value>}
                                 'ports': {<port_no>: {'priority': <value>,
                                                       'path_cost': <value>,
-                                                      'enable': <True/False>},
+                                                      'enable': <True/False>,
+                                                      'edge': <True/False>},
                                           <port_no>: {...},,,}}
                        <dpid>: {...},
                        <dpid>: {...},,,}
@@ -230,16 +505,123 @@ class Stp(app_manager.RyuApp):
              |        | max_age    | bpdu.DEFAULT_MAX_AGE         |
              |        | hello_time | bpdu.DEFAULT_HELLO_TIME      |
              |        | fwd_delay  | bpdu.DEFAULT_FORWARD_DELAY   |
+             |        | protocol   | PROTOCOL_STP                 |
              |--------|------------|------------------------------|
              | port   | priority   | bpdu.DEFAULT_PORT_PRIORITY   |
              |        | path_cost  | (Set up automatically        |
              |        |            |   according to link speed.)  |
              |        | enable     | True                         |
+             |        | edge       | False                        |
              ------------------------------------------------------
+
+             'protocol' is PROTOCOL_STP (802.1D), PROTOCOL_RSTP
+              (802.1w, rapid spanning tree) or PROTOCOL_CENTRALIZED
+              (tree computed by the controller, see set_links()).
+             'edge' tells that the port is connected to a host, not to
+              a bridge: it forwards right away (PortFast). A port is also
+              an edge port once found by set_edge_port(), or when no BPDU
+              was received on it for EDGE_DELAY hello times. It stops
+              being one as soon as a BPDU is received on it (BPDU guard).
         """
         assert isinstance(config, dict)
         self.config = config
 
+    def set_edge_port(self, dpid, port_no):
+        """ Use this API to tell that a host is connected to a port,
+             e.g. when it is found by ryu.topology: the port becomes an
+             edge port and forwards right away. See set_config(). """
+        bridge = self.bridge_list.get(dpid)
+        if bridge is not None and port_no in bridge.ports:
+            bridge.ports[port_no].set_edge()
+
+    def set_links(self, links):
+        """ Use this API to give the links between the bridges,
+             used by the bridges running PROTOCOL_CENTRALIZED.
+            'links' is an iterable of ((<dpid>, <port_no>), (<dpid>, <port_no>)).
+            The spanning tree of these bridges is computed again. """
+        self.links = set(links)
+        self.trees.clear()
+        self.update_centralized_tree()
+
+    def save_tree(self, enabled_ports=None):
+        """ Use this API to save the spanning tree of the bridges before
+             changing their enabled ports (see Bridge.set_port_mask()),
+             like an MSTP instance of the current set of enabled ports.
+            'enabled_ports' are the ports currently enabled, as they were
+             given to restore_tree() or set_port_mask(): the tree is
+             restored for the same 'enabled_ports'.
+            The tree is saved only if it has converged, i.e. no port is
+             in the state of LISTEN or LEARN. Saved trees are dropped
+             when a link, a port or a bridge is added or removed.
+            Return whether the tree was saved. """
+        trees = {}
+        for dpid, bridge in self.bridge_list.items():
+            tree = bridge.save_tree()
+            if tree is None:
+                return False
+            trees[dpid] = tree
+        if not trees:
+            return False
+        self.trees[self._port_mask(enabled_ports)] = trees
+        return True
+
+    def restore_tree(self, enabled_ports=None):
+        """ Use this API to enable only 'enabled_ports' by restoring
+             the spanning tree saved with these ports enabled, instead of
+             converging again. Ports are directly forwarding or blocked.
+            'enabled_ports' is {<dpid>: set of <port_no>},
+             None to enable every port.
+            Return False if no tree was saved for these ports. """
+        trees = self.trees.get(self._port_mask(enabled_ports))
+        if trees is None or set(trees) != set(self.bridge_list):
+            return False
+        for dpid, tree in trees.items():
+            self.bridge_list[dpid].restore_tree(tree)
+        return True
+
+    def set_loop_free_tree(self, links, enabled_ports=None):
+        """ Use this API to enable only 'enabled_ports' when the links
+             between them make no loop: every enabled port is directly
+             forwarding, instead of converging again.
+             See compute_loop_free_tree().
+            'links' is an iterable of ((<dpid>, <port_no>), (<dpid>, <port_no>)).
+             An enabled port with no link in it must be an edge port,
+             see set_edge_port().
+            Return False if the links make a loop or a port is unknown. """
+        trees = compute_loop_free_tree(self.bridge_list, links,
+                                       enabled_ports)
+        if trees is None:
+            return False
+        for dpid, tree in trees.items():
+            self.bridge_list[dpid].restore_tree(tree)
+        return True
+
+    def _port_mask(self, enabled_ports=None):
+        """ Key of the trees saved by save_tree(): the set of
+             (<dpid>, <port_no>) of 'enabled_ports', every port if None. """
+        return frozenset(
+            (dpid, port_no)
+            for dpid, bridge in self.bridge_list.items()
+            for port_no, port in bridge.ports.items()
+            if port.config_enable and (enabled_ports is None
+                                       or port_no in enabled_ports.get(dpid, ())))
+
+    def update_centralized_tree(self):
+        """ Compute the spanning tree of the bridges running
+             PROTOCOL_CENTRALIZED and apply the port roles. """
+        bridges = dict((dpid, bridge)
+                       for dpid, bridge in self.bridge_list.items()
+                       if bridge.centralized)
+        if not bridges:
+            return
+        port_roles = compute_spanning_tree(bridges, self.links)
+        linked_ports = {}
+        for link in self.links:
+            for dpid, port_no in link:
+                linked_ports.setdefault(dpid, set()).add(port_no)
+        for dpid, roles in port_roles.items():
+            bridges[dpid].set_port_roles(roles, linked_ports.get(dpid, ()))
+
     @set_ev_cls(ofp_event.EventOFPStateChange,
                 [handler.MAIN_DISPATCHER, handler.DEAD_DISPATCHER])
     def dispacher_change(self, ev):
@@ -257,19 +639,27 @@ class Stp(app_manager.RyuApp):
         try:
             bridge = Bridge(dp, self.logger,
                             self.config.get(dp.id, {}),
-                            self.send_event_to_observers)
+                            self.send_event_to_observers,
+                            self.update_centralized_tree,
+                            self.scheduler)
         except OFPUnknownVersion as message:
             self.logger.error(str(message), extra=dpid_str)
             return
 
         self.bridge_list[dp.id] = bridge
+        self.trees.clear()
+        if bridge.centralized:
+            self.update_centralized_tree()
 
     def _unregister_bridge(self, dp_id):
         if dp_id in self.bridge_list:
-            self.bridge_list[dp_id].delete()
-            del self.bridge_list[dp_id]
+            bridge = self.bridge_list.pop(dp_id)
+            bridge.delete()
+            self.trees.clear()
             self.logger.info('Leave stp bridge.',
                              extra={'dpid': dpid_to_str(dp_id)})
+            if bridge.centralized:
+                self.update_centralized_tree()
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, handler.MAIN_DISPATCHER)
     def packet_in_handler(self, ev):
@@ -289,10 +679,14 @@ class Stp(app_manager.RyuApp):
             bridge = self.bridge_list[dp.id]
 
             if reason is dp.ofproto.OFPPR_ADD:
+                self.trees.clear()
                 self.logger.info('[port=%d] Port add.',
                                  port.port_no, extra=dpid_str)
                 bridge.port_add(port)
+                if bridge.centralized:
+                    bridge.recalculate_spanning_tree()
             elif reason is dp.ofproto.OFPPR_DELETE:
+                self.trees.clear()
                 self.logger.info('[port=%d] Port delete.',
                                  port.port_no, extra=dpid_str)
                 bridge.port_delete(port)
@@ -303,6 +697,7 @@ class Stp(app_manager.RyuApp):
                     self.logger.debug('[port=%d] Link status not changed.',
                                       port.port_no, extra=dpid_str)
                     return
+                self.trees.clear()
                 if link_down_flg:
                     self.logger.info('[port=%d] Link down.',
                                      port.port_no, extra=dpid_str)
@@ -339,28 +734,19 @@ class Stp(app_manager.RyuApp):
         if my_priority is None:
             result = SUPERIOR
         else:
-            result = Stp._cmp_value(rcv_priority.root_id.value,
-                                    my_priority.root_id.value)
+            result = Stp._cmp_value(rcv_priority.key, my_priority.key)
             if not result:
-                result = Stp.compare_root_path(
-                    rcv_priority.root_path_cost,
-                    my_priority.root_path_cost,
+                result1 = Stp._cmp_value(
                     rcv_priority.designated_bridge_id.value,
-                    my_priority.designated_bridge_id.value,
+                    mac.haddr_to_int(
+                        my_priority.designated_bridge_id.mac_addr))
+                result2 = Stp._cmp_value(
                     rcv_priority.designated_port_id.value,
-                    my_priority.designated_port_id.value)
-                if not result:
-                    result1 = Stp._cmp_value(
-                        rcv_priority.designated_bridge_id.value,
-                        mac.haddr_to_int(
-                            my_priority.designated_bridge_id.mac_addr))
-                    result2 = Stp._cmp_value(
-                        rcv_priority.designated_port_id.value,
-                        my_priority.designated_port_id.port_no)
-                    if not result1 and not result2:
-                        result = SUPERIOR
-                    else:
-                        result = Stp._cmp_obj(rcv_times, my_times)
+                    my_priority.designated_port_id.port_no)
+                if not result1 and not result2:
+                    result = SUPERIOR
+                else:
+                    result = Stp._cmp_obj(rcv_times, my_times)
         return result
 
     @staticmethod
@@ -375,11 +761,7 @@ class Stp(app_manager.RyuApp):
 
     @staticmethod
     def _cmp_obj(obj1, obj2):
-        for key in obj1.__dict__.keys():
-            if (not hasattr(obj2, key)
-                    or getattr(obj1, key) != getattr(obj2, key)):
-                return SUPERIOR
-        return REPEATED
+        return REPEATED if obj1 == obj2 else SUPERIOR
 
 
 class Bridge(object):
@@ -387,21 +769,35 @@ class Bridge(object):
                       'sys_ext_id': 0,
                       'max_age': bpdu.DEFAULT_MAX_AGE,
                       'hello_time': bpdu.DEFAULT_HELLO_TIME,
-                      'fwd_delay': bpdu.DEFAULT_FORWARD_DELAY}
+                      'fwd_delay': bpdu.DEFAULT_FORWARD_DELAY,
+                      'protocol': PROTOCOL_STP}
 
-    def __init__(self, dp, logger, config, send_ev_func):
+    def __init__(self, dp, logger, config, send_ev_func,
+                 tree_update_func=None, scheduler=None):
         super(Bridge, self).__init__()
         self.dp = dp
         self.logger = logger
         self.dpid_str = {'dpid': dpid_to_str(dp.id)}
         self.send_event = send_ev_func
+        # (Centralized) Stp.update_centralized_tree
+        self.tree_update_func = tree_update_func
+        # Timers of the ports, shared by the bridges of an Stp
+        self.scheduler = scheduler or TimerScheduler(logger)
+        # OpenFlow messages of the ports, sent only when they change
+        #  the state of the switch
+        self.ofctl = (OfCtl_v1_0(dp) if dp.ofproto == ofproto_v1_0
+                      else OfCtl_v1_2later(dp))
 
         # Bridge data
         bridge_conf = config.get('bridge', {})
-        values = self._DEFAULT_VALUE
+        values = dict(self._DEFAULT_VALUE)
         for key, value in bridge_conf.items():
             values[key] = value
         system_id = list(dp.ports.values())[0].hw_addr
+        assert values['protocol'] in (PROTOCOL_STP, PROTOCOL_RSTP,
+                                      PROTOCOL_CENTRALIZED)
+        self.rstp = bool(values['protocol'] == PROTOCOL_RSTP)
+        self.centralized = bool(values['protocol'] == PROTOCOL_CENTRALIZED)
 
         self.bridge_id = BridgeId(values['priority'],
                                   values['sys_ext_id'],
@@ -416,14 +812,15 @@ class Bridge(object):
         # Ports
         self.ports = {}
         self.ports_state = {}
+        # Topology changes deferred by set_port_mask() and restore_tree()
+        self.pending_tc = None
         self.ports_conf = config.get('ports', {})
         for ofport in dp.ports.values():
             self.port_add(ofport)
 
         # Install BPDU PacketIn flow. (OpenFlow 1.2/1.3)
         if dp.ofproto == ofproto_v1_2 or dp.ofproto == ofproto_v1_3:
-            ofctl = OfCtl_v1_2later(self.dp)
-            ofctl.add_bpdu_pkt_in_flow()
+            self.ofctl.add_bpdu_pkt_in_flow()
 
     @property
     def is_root_bridge(self):
@@ -436,37 +833,136 @@ class Bridge(object):
     def port_add(self, ofport):
         if ofport.port_no <= MAX_PORT_NO:
             port_conf = self.ports_conf.get(ofport.port_no, {})
+            self.ofctl.forget_port(ofport.port_no)
             self.ports[ofport.port_no] = Port(self.dp, self.logger,
                                               port_conf, self.send_event,
                                               self.recalculate_spanning_tree,
                                               self.topology_change_notify,
                                               self.bridge_id,
                                               self.bridge_times,
-                                              ofport)
+                                              ofport, rstp=self.rstp,
+                                              centralized=self.centralized,
+                                              scheduler=self.scheduler,
+                                              ofctl=self.ofctl)
             self.ports_state[ofport.port_no] = ofport.state
 
     def port_delete(self, ofp_port):
         self.link_down(ofp_port)
         self.ports[ofp_port.port_no].delete()
+        self.ofctl.forget_port(ofp_port.port_no)
         del self.ports[ofp_port.port_no]
         del self.ports_state[ofp_port.port_no]
 
+    @property
+    def initial_role(self):
+        """ Role of a port brought up. (Centralized) Blocked until
+             the tree is computed again. """
+        return ALTERNATE_PORT if self.centralized else DESIGNATED_PORT
+
     def link_up(self, ofp_port):
         port = self.ports[ofp_port.port_no]
-        port.up(DESIGNATED_PORT, self.root_priority, self.root_times)
+        port.up(self.initial_role, self.root_priority, self.root_times)
         self.ports_state[ofp_port.port_no] = ofp_port.state
+        if self.centralized:
+            self.recalculate_spanning_tree()
 
     def link_down(self, ofp_port):
         """ DESIGNATED_PORT/NON_DESIGNATED_PORT: change status to DISABLE.
             ROOT_PORT: change status to DISABLE and recalculate STP. """
         port = self.ports[ofp_port.port_no]
-        init_stp_flg = bool(port.role is ROOT_PORT)
+        init_stp_flg = bool(port.role is ROOT_PORT or self.centralized)
 
         port.down(PORT_STATE_DISABLE, msg_init=True)
         self.ports_state[ofp_port.port_no] = ofp_port.state
         if init_stp_flg:
             self.recalculate_spanning_tree()
 
+    def set_port_mask(self, enable_ports=(), disable_ports=(),
+                      recalculate=False):
+        """ Enable and disable a set of ports as a single transaction.
+            Ports are disabled first, then enabled. The spanning tree is
+             recalculated once at the end if the ROOT_PORT was disabled
+             or if 'recalculate' is True, and the topology changes
+             raised meanwhile are notified only once. """
+        self.pending_tc = []
+        try:
+            init_stp_flg = recalculate or self.centralized
+            for port_no in disable_ports:
+                port = self.ports[port_no]
+                init_stp_flg |= bool(port.role is ROOT_PORT)
+                port.down(PORT_STATE_DISABLE, msg_init=True)
+
+            for port_no in enable_ports:
+                port = self.ports[port_no]
+                if init_stp_flg:
+                    # Started by the recalculation below.
+                    port.down(PORT_STATE_BLOCK, msg_init=True)
+                else:
+                    port.up(DESIGNATED_PORT, self.root_priority,
+                            self.root_times)
+
+            if init_stp_flg:
+                self.recalculate_spanning_tree()
+        finally:
+            pending_tc, self.pending_tc = self.pending_tc, None
+
+        self._notify_pending_tc(pending_tc)
+
+    def save_tree(self):
+        """ Get the role, state and received information of every port,
+             None if some port is in the state of LISTEN or LEARN. """
+        ports = {}
+        for port_no, port in self.ports.items():
+            if (port.state is PORT_STATE_LISTEN
+                    or port.state is PORT_STATE_LEARN):
+                return None
+            ports[port_no] = PortTree(port.role, port.state,
+                                      port.designated_priority,
+                                      port.designated_times)
+        return BridgeTree(self.root_priority, self.root_times, ports)
+
+    def restore_tree(self, tree):
+        """ Set the ports back to a tree got with save_tree(), as a
+             single transaction like set_port_mask(). """
+        self.pending_tc = []
+        try:
+            self.root_priority = tree.root_priority
+            self.root_times = tree.root_times
+            # Disable ports first, as set_port_mask() does.
+            port_trees = sorted(
+                tree.ports.items(),
+                key=lambda item: item[1].state is not PORT_STATE_DISABLE)
+            for port_no, port_tree in port_trees:
+                port = self.ports.get(port_no)
+                if port is not None:
+                    port.restore(port_tree, tree.root_priority,
+                                 tree.root_times)
+        finally:
+            pending_tc, self.pending_tc = self.pending_tc, None
+
+        self._notify_pending_tc(pending_tc)
+
+    def _notify_pending_tc(self, pending_tc):
+        """ Notify the topology changes deferred by set_port_mask()
+             or restore_tree() at once. """
+        if pending_tc:
+            port_nos = frozenset()
+            for _, changed in pending_tc:
+                if changed is None:
+                    port_nos = None
+                    break
+                port_nos |= changed
+            if any(state is not PORT_STATE_FORWARD
+                   for state, _ in pending_tc):
+                self.topology_change_notify(PORT_STATE_DISABLE, port_nos)
+            else:
+                self.topology_change_notify(PORT_STATE_FORWARD, port_nos)
+
+    def _other_port_nos(self, port_no):
+        """ Get the ports whose learned addresses are stale after
+             a topology change received on a port: all the others. """
+        return frozenset(no for no in self.ports if no != port_no)
+
     def packet_in_handler(self, msg):
         dp = msg.datapath
         if dp.ofproto == ofproto_v1_0:
@@ -485,32 +981,34 @@ class Bridge(object):
         if in_port.state == PORT_STATE_DISABLE:
             return
 
+        # Fast path: data frames only need their Ethernet header.
+        if len(msg.data) < ETH_HEADER.size:
+            return
+        if not is_bpdu_frame(msg.data):
+            self.send_event(EventPacketIn(msg, parse_ethernet_header(msg.data)))
+            return
+        if self.centralized:
+            return
+        if in_port.rcv_bpdu():
+            # Not an edge port anymore: started again as a regular port.
+            in_port.down(PORT_STATE_BLOCK, msg_init=True)
+            in_port.up(DESIGNATED_PORT, self.root_priority, self.root_times)
+
+        # Fast path: the same BPDU as the last one received on the port
+        #  can only carry REPEATED information.
+        if in_port.rcv_repeated_bpdu(msg.data):
+            if in_port.role is ROOT_PORT:
+                self._forward_tc_bpdu(False)
+            return
+
         pkt = packet.Packet(msg.data)
         if bpdu.ConfigurationBPDUs in pkt:
             # Received Configuration BPDU.
-            # - If received superior BPDU:
-            #    Re-calculates spanning tree.
-            # - If received Topology Change BPDU:
-            #    Throws EventTopologyChange.
-            #    Forwards Topology Change BPDU.
+            # A RSTP port falls back to STP: the other end is a legacy bridge.
             (bpdu_pkt, ) = pkt.get_protocols(bpdu.ConfigurationBPDUs)
-            if bpdu_pkt.message_age > bpdu_pkt.max_age:
-                log_msg = 'Drop BPDU packet which message_age exceeded.'
-                self.logger.debug(log_msg, extra=self.dpid_str)
-                return
-
-            rcv_info, rcv_tc = in_port.rcv_config_bpdu(bpdu_pkt)
-
-            if rcv_info is SUPERIOR:
-                self.logger.info('[port=%d] Receive superior BPDU.',
-                                 in_port_no, extra=self.dpid_str)
-                self.recalculate_spanning_tree(init=False)
-
-            elif rcv_tc:
-                self.send_event(EventTopologyChange(self.dp))
-
-            if in_port.role is ROOT_PORT:
-                self._forward_tc_bpdu(rcv_tc)
+            if in_port.rstp:
+                in_port.fall_back_to_stp()
+            self._rcv_config_bpdu(in_port, bpdu_pkt, msg.data)
 
         elif bpdu.TopologyChangeNotificationBPDUs in pkt:
             # Received Topology Change Notification BPDU.
@@ -520,27 +1018,83 @@ class Bridge(object):
             # - Non root bridge:
             #    Sends Topology Change Notification BPDU to root bridge.
             in_port.transmit_ack_bpdu()
-            self.topology_change_notify(None)
+            self.topology_change_notify(None, except_port_no=in_port_no)
 
         elif bpdu.RstBPDUs in pkt:
             # Received Rst BPDU.
-            # TODO: RSTP
-            pass
+            # - Sent by a DESIGNATED_PORT:
+            #    Handled like a Configuration BPDU, then agrees to
+            #    the proposal if the port is not a DESIGNATED_PORT.
+            # - Sent by other ports:
+            #    Carries the agreement to our proposal, or
+            #    the ack of our Topology Change Notification.
+            (bpdu_pkt, ) = pkt.get_protocols(bpdu.RstBPDUs)
+            role = (bpdu_pkt.flags & RSTP_ROLE_MASK) >> RSTP_ROLE_SHIFT
+            if role == RSTP_ROLE_DESIGNATED:
+                self._rcv_config_bpdu(in_port, bpdu_pkt, msg.data)
+                if (self.rstp and bpdu_pkt.flags & RSTP_FLAG_PROPOSAL
+                        and in_port.role is not DESIGNATED_PORT):
+                    in_port.transmit_agreement_bpdu()
+            else:
+                in_port.rcv_rst_bpdu_flags(bpdu_pkt.flags)
 
         else:
             # Received non BPDU packet.
             # Throws EventPacketIn.
-            self.send_event(EventPacketIn(msg))
+            self.send_event(EventPacketIn(msg, parse_ethernet_header(msg.data)))
+
+    def _rcv_config_bpdu(self, in_port, bpdu_pkt, data=None):
+        """ Handle a Configuration BPDU, or a RST BPDU sent by
+             a DESIGNATED_PORT.
+            - If received superior BPDU:
+               Re-calculates spanning tree.
+            - If received Topology Change BPDU:
+               Throws EventTopologyChange.
+               Forwards Topology Change BPDU. """
+        if bpdu_pkt.message_age > bpdu_pkt.max_age:
+            log_msg = 'Drop BPDU packet which message_age exceeded.'
+            self.logger.debug(log_msg, extra=self.dpid_str)
+            return
+
+        rcv_info, rcv_tc = in_port.rcv_config_bpdu(bpdu_pkt, data)
+
+        if rcv_info is SUPERIOR:
+            self.logger.info('[port=%d] Receive superior BPDU.',
+                             in_port.ofport.port_no, extra=self.dpid_str)
+            self.recalculate_spanning_tree(init=False)
+
+        elif rcv_tc:
+            self.send_event(EventTopologyChange(
+                self.dp, self._other_port_nos(in_port.ofport.port_no)))
+
+        if (self.rstp and rcv_info is INFERIOR
+                and in_port.role is DESIGNATED_PORT and in_port.rstp):
+            # (RSTP) Tell the other end about the better information now,
+            #  instead of waiting for the next hello time.
+            in_port.transmit_config_bpdu()
+
+        if in_port.role is ROOT_PORT:
+            self._forward_tc_bpdu(rcv_tc)
 
     def recalculate_spanning_tree(self, init=True):
         """ Re-calculation of spanning tree. """
+        if self.centralized:
+            if self.tree_update_func is not None:
+                self.tree_update_func()
+            return
+
+        if self.rstp and not init and self._update_port_roles():
+            return
+
         # All port down.
         for port in self.ports.values():
             if port.state is not PORT_STATE_DISABLE:
                 port.down(PORT_STATE_BLOCK, msg_init=init)
 
         # Send topology change event.
-        if init:
+        if init and self.pending_tc is not None:
+            self.pending_tc.append((PORT_STATE_BLOCK, None))
+        elif init:
             self.send_event(EventTopologyChange(self.dp))
 
         # Update tree roles.
@@ -563,6 +1117,58 @@ class Bridge(object):
                 self.ports[port_no].up(role, self.root_priority,
                                        self.root_times)
 
+    def set_port_roles(self, port_roles, linked_ports=()):
+        """ (Centralized) Apply the port roles computed by the controller.
+            'linked_ports' are the ports with a known link.
+            Only the ports whose role or state changes are updated. """
+        for port_no, role in port_roles.items():
+            port = self.ports.get(port_no)
+            if port is None or port.state is PORT_STATE_DISABLE:
+                continue
+            link_known = port_no in linked_ports
+            if link_known and not port.link_known:
+                # A bridge is connected: not an edge port.
+                port.edge = False
+            port.link_known = link_known
+            state = port.centralized_state(role)
+            if port.role is role and port.state is state:
+                continue
+            port.up(role, self.root_priority, self.root_times)
+
+    def _update_port_roles(self):
+        """ (RSTP) Re-start only the ports whose role changed, if the
+             root bridge and the ROOT_PORT are kept.
+            Return False if all ports have to be re-started (sync). """
+        old_root_id = self.root_priority.root_id.value
+        old_root_port = None
+        for port in self.ports.values():
+            if port.role is ROOT_PORT:
+                old_root_port = port.ofport.port_no
+
+        self.root_priority = Priority(self.bridge_id, 0, None, None)
+        self.root_times = self.bridge_times
+        port_roles, root_priority, root_times = self._spanning_tree_algorithm()
+
+        root_port = None
+        for port_no, role in port_roles.items():
+            if role is ROOT_PORT:
+                root_port = port_no
+        if (root_port != old_root_port
+                or root_priority.root_id.value != old_root_id):
+            return False
+
+        self.root_priority = root_priority
+        self.root_times = root_times
+        for port_no, role in port_roles.items():
+            port = self.ports[port_no]
+            if port.role is role:
+                port.port_priority = root_priority
+                port.port_times = root_times
+            else:
+                port.down(PORT_STATE_BLOCK)
+                port.up(role, root_priority, root_times)
+        return True
+
     def _spanning_tree_algorithm(self):
         """ Update tree roles.
              - Root bridge:
@@ -598,39 +1204,35 @@ class Bridge(object):
             for port in self.ports.values():
                 if port.state is not PORT_STATE_DISABLE:
                     port_roles.setdefault(port.ofport.port_no,
-                                          NON_DESIGNATED_PORT)
+                                          self._non_designated_role(port))
 
         return port_roles, root_priority, root_times
 
+    def _non_designated_role(self, port):
+        """ (RSTP) A blocked port is a BACKUP_PORT if the designated
+             port of its segment belongs to this bridge,
+             an ALTERNATE_PORT otherwise. """
+        if not self.rstp:
+            return NON_DESIGNATED_PORT
+        msg = port.designated_priority
+        if (msg is not None and msg.designated_bridge_id is not None
+                and msg.designated_bridge_id.value == self.bridge_id.value):
+            return BACKUP_PORT
+        return ALTERNATE_PORT
+
     def _select_root_port(self):
         """ ROOT_PORT is the nearest port to a root bridge.
             It is determined by the cost of path, etc. """
         root_port = None
+        root_key = self.root_priority.key
 
         for port in self.ports.values():
-            root_msg = (self.root_priority if root_port is None
-                        else root_port.designated_priority)
             port_msg = port.designated_priority
             if port.state is PORT_STATE_DISABLE or port_msg is None:
                 continue
-            if root_msg.root_id.value > port_msg.root_id.value:
-                result = SUPERIOR
-            elif root_msg.root_id.value == port_msg.root_id.value:
-                if root_msg.designated_bridge_id is None:
-                    result = INFERIOR
-                else:
-                    result = Stp.compare_root_path(
-                        port_msg.root_path_cost,
-                        root_msg.root_path_cost,
-                        port_msg.designated_bridge_id.value,
-                        root_msg.designated_bridge_id.value,
-                        port_msg.designated_port_id.value,
-                        root_msg.designated_port_id.value)
-            else:
-                result = INFERIOR
-
-            if result is SUPERIOR:
+            if port_msg.key < root_key:
                 root_port = port
+                root_key = port_msg.key
 
         return root_port
 
@@ -640,6 +1242,9 @@ class Bridge(object):
             same as ROOT_PORT. """
         d_ports = []
         root_msg = root_port.designated_priority
+        # The path through this bridge, compared to the path
+        #  through the designated bridge of each link.
+        root_path = (root_msg.root_path_cost, self.bridge_id.value)
 
         for port in self.ports.values():
             port_msg = port.designated_priority
@@ -649,20 +1254,32 @@ class Bridge(object):
             if (port_msg is None or
                     (port_msg.root_id.value != root_msg.root_id.value)):
                 d_ports.append(port.ofport.port_no)
-            else:
-                result = Stp.compare_root_path(
-                    root_msg.root_path_cost,
-                    port_msg.root_path_cost - port.path_cost,
-                    self.bridge_id.value,
-                    port_msg.designated_bridge_id.value,
-                    port.port_id.value,
-                    port_msg.designated_port_id.value)
-                if result is SUPERIOR:
-                    d_ports.append(port.ofport.port_no)
+            elif (root_path + (port.port_id.value,)
+                  < (port_msg.root_path_cost - port.path_cost,)
+                  + port_msg.key[2:]):
+                d_ports.append(port.ofport.port_no)
 
         return d_ports
 
-    def topology_change_notify(self, port_state):
+    def topology_change_notify(self, port_state, port_nos=None,
+                               except_port_no=None):
+        """ Notify a topology change, caused by ports changing
+             state or received from another bridge.
+            'port_nos' are the ports whose learned addresses are stale,
+             see EventTopologyChange. With 'except_port_no', they are
+             all the ports but this one: a port that starts forwarding
+             or that received the topology change (802.1w). """
+        if except_port_no is not None:
+            port_nos = self._other_port_nos(except_port_no)
+        if self.pending_tc is not None:
+            # Notified at the end of set_port_mask().
+            self.pending_tc.append((port_state, port_nos))
+            return
+        if self.centralized:
+            # No BPDU: every bridge is notified by its own ports.
+            self.send_event(EventTopologyChange(self.dp, port_nos))
+            return
+
         notice = False
         if port_state is PORT_STATE_FORWARD:
             for port in self.ports.values():
@@ -673,7 +1290,7 @@ class Bridge(object):
             notice = True
 
         if notice:
-            self.send_event(EventTopologyChange(self.dp))
+            self.send_event(EventTopologyChange(self.dp, port_nos))
             if self.is_root_bridge:
                 self._transmit_tc_bpdu()
             else:
@@ -700,10 +1317,12 @@ class Bridge(object):
 class Port(object):
     _DEFAULT_VALUE = {'priority': bpdu.DEFAULT_PORT_PRIORITY,
                       'path_cost': bpdu.PORT_PATH_COST_10MB,
-                      'enable': True}
+                      'enable': True,
+                      'edge': False}
 
     def __init__(self, dp, logger, config, send_ev_func, timeout_func,
-                 topology_change_func, bridge_id, bridge_times, ofport):
+                 topology_change_func, bridge_id, bridge_times, ofport,
+                 rstp=False, centralized=False, scheduler=None, ofctl=None):
         super(Port, self).__init__()
         self.dp = dp
         self.logger = logger
@@ -713,8 +1332,9 @@ class Port(object):
         self.send_event = send_ev_func
         self.wait_bpdu_timeout = timeout_func
         self.topology_change_notify = topology_change_func
-        self.ofctl = (OfCtl_v1_0(dp) if dp.ofproto == ofproto_v1_0
-                      else OfCtl_v1_2later(dp))
+        # Shared by the ports of a Bridge, see OfCtl_v1_0
+        self.ofctl = ofctl or (OfCtl_v1_0(dp) if dp.ofproto == ofproto_v1_0
+                               else OfCtl_v1_2later(dp))
 
         # Bridge data
         self.bridge_id = bridge_id
@@ -724,7 +1344,7 @@ class Port(object):
         # ofproto_v1_X_parser.OFPPhyPort data
         self.ofport = ofport
         # Port data
-        values = self._DEFAULT_VALUE
+        values = dict(self._DEFAULT_VALUE)
         path_costs = {dp.ofproto.OFPPF_10MB_HD: bpdu.PORT_PATH_COST_10MB,
                       dp.ofproto.OFPPF_10MB_FD: bpdu.PORT_PATH_COST_10MB,
                       dp.ofproto.OFPPF_100MB_HD: bpdu.PORT_PATH_COST_100MB,
@@ -736,58 +1356,96 @@ class Port(object):
             if ofport.curr & rate:
                 values['path_cost'] = path_costs[rate]
                 break
-        for key, value in values.items():
+        for key, value in config.items():
             values[key] = value
         self.port_id = PortId(values['priority'], ofport.port_no)
         self.path_cost = values['path_cost']
         self.state = (None if self.config_enable else PORT_STATE_DISABLE)
         self.role = None
+        # RSTP is used unless a legacy bridge is detected on the link
+        self.rstp_enabled = rstp
+        self.rstp = rstp
+        # No BPDU nor timer, roles are set by Bridge.set_port_roles()
+        self.centralized = centralized
+        # (Centralized) Whether the link of the port is known
+        self.link_known = False
+        # Edge port (PortFast): no bridge on the link, see set_edge()
+        self.edge_enabled = values['edge']
+        self.edge = self.edge_enabled
+        self.bpdu_received = False
+        self.edge_timer = None
         # Receive BPDU data
         self.designated_priority = None
         self.designated_times = None
-        # BPDU handling threads
-        self.send_bpdu_thread = PortThread(self._transmit_bpdu)
-        self.wait_bpdu_thread = PortThread(self._wait_bpdu_timer)
+        # BPDU handling timers
+        self.scheduler = scheduler or TimerScheduler(logger)
+        self.send_bpdu_timer = None
+        self.wait_bpdu_timer = None
         self.send_tc_flg = None
         self.send_tc_timer = None
         self.send_tcn_flg = None
-        self.wait_timer_event = None
-        # State machine thread
-        self.state_machine = PortThread(self._state_machine)
-        self.state_event = None
-
-        self.up(DESIGNATED_PORT,
+        # BPDU frames, generated again when the priority or times change
+        self.config_bpdu_key = None
+        self.config_bpdu_template = None
+        self.tcn_bpdu = None
+        # Last REPEATED BPDU received, see rcv_repeated_bpdu()
+        self.rcv_bpdu_cache = None
+        # State machine timer
+        self.state_timer = None
+
+        self.up(ALTERNATE_PORT if centralized else DESIGNATED_PORT,
                 Priority(bridge_id, 0, None, None),
                 bridge_times)
 
-        self.state_machine.start()
-        self.logger.debug('[port=%d] Start port state machine.',
-                          self.ofport.port_no, extra=self.dpid_str)
+        if self.state is PORT_STATE_DISABLE:
+            self.ofctl.set_port_status(self.ofport, self.state)
 
     def delete(self):
-        self.state_machine.stop()
-        self.send_bpdu_thread.stop()
-        self.wait_bpdu_thread.stop()
-        if self.state_event is not None:
-            self.state_event.set()
-            self.state_event = None
-        if self.wait_timer_event is not None:
-            self.wait_timer_event.set()
-            self.wait_timer_event = None
-        self.logger.debug('[port=%d] Stop port threads.',
+        for timer in (self.state_timer, self.send_bpdu_timer,
+                      self.wait_bpdu_timer, self.edge_timer):
+            if timer is not None:
+                timer.cancel()
+        self.state_timer = None
+        self.send_bpdu_timer = None
+        self.wait_bpdu_timer = None
+        self.edge_timer = None
+        self.logger.debug('[port=%d] Stop port timers.',
                           self.ofport.port_no, extra=self.dpid_str)
 
     def up(self, role, root_priority, root_times):
-        """ A port is started in the state of LISTEN.  """
+        """ A port is started in the state of LISTEN.
+            An edge DESIGNATED_PORT is started in the state of FORWARD.
+            (RSTP) A ROOT_PORT is started in the state of FORWARD,
+             an ALTERNATE_PORT or BACKUP_PORT in the state of BLOCK. """
         self.port_priority = root_priority
         self.port_times = root_times
 
-        state = (PORT_STATE_LISTEN if self.config_enable
-                 else PORT_STATE_DISABLE)
+        if not self.config_enable:
+            state = PORT_STATE_DISABLE
+        elif self.centralized:
+            state = self.centralized_state(role)
+        elif self.edge and role is DESIGNATED_PORT:
+            state = PORT_STATE_FORWARD
+        elif self.rstp and role is ROOT_PORT:
+            state = PORT_STATE_FORWARD
+        elif self.rstp and role in BLOCKED_PORT_ROLES:
+            state = PORT_STATE_BLOCK
+        else:
+            state = PORT_STATE_LISTEN
         self._change_role(role)
         self._change_status(state)
 
-    def down(self, state, msg_init=False):
+    def centralized_state(self, role):
+        """ (Centralized) State of the port with 'role': a port without
+             known link is in the state of LISTEN, unless it is an edge
+             port, since the link to a bridge may not be discovered yet. """
+        if role in BLOCKED_PORT_ROLES:
+            return PORT_STATE_BLOCK
+        if self.link_known or self.edge:
+            return PORT_STATE_FORWARD
+        return PORT_STATE_LISTEN
+
+    def down(self, state, msg_init=False, thread_switch=True):
         """ A port will be in the state of DISABLE or BLOCK,
              and be stopped.  """
         assert (state is PORT_STATE_DISABLE
@@ -798,49 +1456,120 @@ class Port(object):
         if msg_init:
             self.designated_priority = None
             self.designated_times = None
+        if state is PORT_STATE_DISABLE:
+            # Detect the protocol of the other end again.
+            self.rstp = self.rstp_enabled
+            self.rcv_bpdu_cache = None
 
         self._change_role(DESIGNATED_PORT)
-        self._change_status(state)
+        self._change_status(state, thread_switch=thread_switch)
+
+        if state is PORT_STATE_DISABLE:
+            # And whether it is a bridge, once the topology change
+            #  of the port going down was decided as an edge port.
+            self.edge = self.edge_enabled
+            self.bpdu_received = False
+
+    def restore(self, port_tree, root_priority, root_times):
+        """ Set the port back to the role and state saved by
+             Bridge.save_tree(), without going through LISTEN and LEARN.
+            The port is not touched if they have not changed.
+            Other threads don't run meanwhile, so that no BPDU is sent
+             while only some bridges have their tree restored. """
+        if port_tree.state is PORT_STATE_DISABLE:
+            if self.state is not PORT_STATE_DISABLE:
+                self.down(PORT_STATE_DISABLE, msg_init=True,
+                          thread_switch=False)
+            return
+        if not self.config_enable:
+            return
+
+        self.port_priority = root_priority
+        self.port_times = root_times
+        self.designated_priority = port_tree.designated_priority
+        self.designated_times = port_tree.designated_times
+        if self.role is port_tree.role and self.state is port_tree.state:
+            return
+        self._change_role(port_tree.role)
+        self._change_status(port_tree.state, thread_switch=False)
 
-    def _state_machine(self):
+    def _start_state_timer(self):
         """ Port state machine.
              Change next status when timer is exceeded
              or _change_status() method is called."""
         role_str = {ROOT_PORT: 'ROOT_PORT          ',
                     DESIGNATED_PORT: 'DESIGNATED_PORT    ',
-                    NON_DESIGNATED_PORT: 'NON_DESIGNATED_PORT'}
+                    NON_DESIGNATED_PORT: 'NON_DESIGNATED_PORT',
+                    ALTERNATE_PORT: 'ALTERNATE_PORT     ',
+                    BACKUP_PORT: 'BACKUP_PORT        '}
         state_str = {PORT_STATE_DISABLE: 'DISABLE',
                      PORT_STATE_BLOCK: 'BLOCK',
                      PORT_STATE_LISTEN: 'LISTEN',
                      PORT_STATE_LEARN: 'LEARN',
                      PORT_STATE_FORWARD: 'FORWARD'}
 
-        if self.state is PORT_STATE_DISABLE:
-            self.ofctl.set_port_status(self.ofport, self.state)
-
-        while True:
-            self.logger.info('[port=%d] %s / %s', self.ofport.port_no,
-                             role_str[self.role], state_str[self.state],
-                             extra=self.dpid_str)
-
-            self.state_event = hub.Event()
-            timer = self._get_timer()
-            if timer:
-                timeout = hub.Timeout(timer)
-                try:
-                    self.state_event.wait()
-                except hub.Timeout as t:
-                    if t is not timeout:
-                        err_msg = 'Internal error. Not my timeout.'
-                        raise RyuException(msg=err_msg)
-                    new_state = self._get_next_state()
-                    self._change_status(new_state, thread_switch=False)
-                finally:
-                    timeout.cancel()
-            else:
-                self.state_event.wait()
-
-            self.state_event = None
+        self.logger.info('[port=%d] %s / %s', self.ofport.port_no,
+                         role_str[self.role], state_str[self.state],
+                         extra=self.dpid_str)
+
+        if self.state_timer is not None:
+            self.state_timer.cancel()
+            self.state_timer = None
+        timer = None if self.centralized else self._get_timer()
+        if timer:
+            self.state_timer = self.scheduler.schedule(timer,
+                                                       self._state_timeout)
+
+        # Edge port detection, while going to the state of FORWARD.
+        detect_edge = ((self.state is PORT_STATE_LISTEN
+                        or self.state is PORT_STATE_LEARN)
+                       and self.role is DESIGNATED_PORT
+                       and not self.edge and not self.bpdu_received)
+        if not detect_edge and self.edge_timer is not None:
+            self.edge_timer.cancel()
+            self.edge_timer = None
+        elif detect_edge and self.edge_timer is None:
+            self.edge_timer = self.scheduler.schedule(
+                EDGE_DELAY * self.port_times.hello_time, self._edge_timeout)
+
+    def _edge_timeout(self):
+        self.edge_timer = None
+        self.logger.info('[port=%d] No BPDU received.',
+                         self.ofport.port_no, extra=self.dpid_str)
+        self.set_edge()
+
+    def set_edge(self):
+        """ Make the port an edge port, unless BPDUs were received on it
+             or (Centralized) its link is known:
+             a DESIGNATED_PORT forwards right away. """
+        if (self.edge or self.bpdu_received
+                or (self.centralized and self.link_known)):
+            return
+        self.edge = True
+        self.logger.info('[port=%d] Edge port.',
+                         self.ofport.port_no, extra=self.dpid_str)
+        if (self.role is DESIGNATED_PORT
+                and (self.state is PORT_STATE_LISTEN
+                     or self.state is PORT_STATE_LEARN)):
+            self._change_status(PORT_STATE_FORWARD, thread_switch=False)
+
+    def rcv_bpdu(self):
+        """ Record that a BPDU was received: a bridge is connected.
+             (BPDU guard) An edge port is started again
+             as a regular port.
+            Return whether the port was an edge port. """
+        self.bpdu_received = True
+        if not self.edge:
+            return False
+        self.logger.info('[port=%d] BPDU received on edge port.',
+                         self.ofport.port_no, extra=self.dpid_str)
+        self.edge = False
+        return True
+
+    def _state_timeout(self):
+        self.state_timer = None
+        new_state = self._get_next_state()
+        self._change_status(new_state, thread_switch=False)
 
     def _get_timer(self):
         timer = {PORT_STATE_DISABLE: None,
@@ -865,27 +1594,40 @@ class Port(object):
         if new_state is not PORT_STATE_DISABLE:
             self.ofctl.set_port_status(self.ofport, new_state)
 
-        if(new_state is PORT_STATE_FORWARD
-           or (self.state is PORT_STATE_FORWARD
-               and (new_state is PORT_STATE_DISABLE
-                    or new_state is PORT_STATE_BLOCK))):
-            self.topology_change_notify(new_state)
+        # No topology change for a host coming or going.
+        if self.edge:
+            pass
+        elif new_state is PORT_STATE_FORWARD:
+            # The addresses learned on the other ports may now be
+            #  reached through this one (802.1w).
+            self.topology_change_notify(
+                new_state, except_port_no=self.ofport.port_no)
+        elif (self.state is PORT_STATE_FORWARD
+              and (new_state is PORT_STATE_DISABLE
+                   or new_state is PORT_STATE_BLOCK)):
+            # Only the addresses learned on this port are lost.
+            self.topology_change_notify(
+                new_state, frozenset((self.ofport.port_no,)))
 
         if (new_state is PORT_STATE_DISABLE
                 or new_state is PORT_STATE_BLOCK):
             self.send_tc_flg = False
             self.send_tc_timer = None
             self.send_tcn_flg = False
-            self.send_bpdu_thread.stop()
-        elif new_state is PORT_STATE_LISTEN:
-            self.send_bpdu_thread.start()
+            self._stop_send_bpdu_timer()
+        elif self.centralized:
+            pass
+        elif (new_state is PORT_STATE_LISTEN
+              or self.send_bpdu_timer is None):
+            # (RSTP) A ROOT_PORT skips LISTEN.
+            self._stop_send_bpdu_timer()
+            self.send_bpdu_timer = self.scheduler.schedule(
+                0, self._transmit_bpdu)
 
         self.state = new_state
         self.send_event(EventPortStateChange(self.dp, self))
 
-        if self.state_event is not None:
-            self.state_event.set()
-            self.state_event = None
+        self._start_state_timer()
         if thread_switch:
             hub.sleep(0)  # For thread switching.
 
@@ -893,14 +1635,23 @@ class Port(object):
         if self.role is new_role:
             return
         self.role = new_role
+        if self.centralized:
+            return
         if (new_role is ROOT_PORT
-                or new_role is NON_DESIGNATED_PORT):
-            self.wait_bpdu_thread.start()
+                or new_role in BLOCKED_PORT_ROLES):
+            self._start_wait_bpdu_timer()
         else:
             assert new_role is DESIGNATED_PORT
-            self.wait_bpdu_thread.stop()
+            if self.wait_bpdu_timer is not None:
+                self.wait_bpdu_timer.cancel()
+                self.wait_bpdu_timer = None
+
+    def _stop_send_bpdu_timer(self):
+        if self.send_bpdu_timer is not None:
+            self.send_bpdu_timer.cancel()
+            self.send_bpdu_timer = None
 
-    def rcv_config_bpdu(self, bpdu_pkt):
+    def rcv_config_bpdu(self, bpdu_pkt, data=None):
         # Check received BPDU is superior to currently held BPDU.
         root_id = BridgeId(bpdu_pkt.root_priority,
                            bpdu_pkt.root_system_id_extension,
@@ -930,7 +1681,7 @@ class Port(object):
         chk_flg = False
         if ((rcv_info is SUPERIOR or rcv_info is REPEATED)
                 and (self.role is ROOT_PORT
-                     or self.role is NON_DESIGNATED_PORT)):
+                     or self.role in BLOCKED_PORT_ROLES)):
             self._update_wait_bpdu_timer()
             chk_flg = True
         elif rcv_info is INFERIOR and self.role is DESIGNATED_PORT:
@@ -951,72 +1702,115 @@ class Port(object):
                 if self.send_tcn_flg:
                     self.send_tcn_flg = False
 
+        # Remember the BPDU for rcv_repeated_bpdu(),
+        #  along with the information it was compared to.
+        if (data is not None and rcv_info is REPEATED
+                and not bpdu_pkt.flags & BPDU_PARSED_FLAGS):
+            self.rcv_bpdu_cache = (bytes(data), self.designated_priority,
+                                   self.designated_times)
+        else:
+            self.rcv_bpdu_cache = None
+
         return rcv_info, rcv_tc
 
+    def rcv_repeated_bpdu(self, data):
+        """ Handle a BPDU identical to the last REPEATED one, without
+             parsing it, as long as the designated priority and times
+             it was compared to are still held by the port.
+             Return False if the BPDU has to be parsed. """
+        cache = self.rcv_bpdu_cache
+        if (cache is None
+                or cache[1] is not self.designated_priority
+                or cache[2] is not self.designated_times
+                or cache[0] != data):
+            return False
+
+        if self.role is ROOT_PORT or self.role in BLOCKED_PORT_ROLES:
+            self._update_wait_bpdu_timer()
+        return True
+
+    def rcv_rst_bpdu_flags(self, flags):
+        """ Handle the flags of a RST BPDU sent by a port
+             other than a DESIGNATED_PORT. """
+        if flags & RSTP_FLAG_TCA and self.send_tcn_flg:
+            self.logger.debug('[port=%d] receive TopologyChangeAck BPDU.',
+                              self.ofport.port_no, extra=self.dpid_str)
+            self.send_tcn_flg = False
+
+        if (self.rstp and flags & RSTP_FLAG_AGREEMENT
+                and self.role is DESIGNATED_PORT
+                and (self.state is PORT_STATE_LISTEN
+                     or self.state is PORT_STATE_LEARN)):
+            self.logger.info('[port=%d] Receive agreement.',
+                             self.ofport.port_no, extra=self.dpid_str)
+            self._change_status(PORT_STATE_FORWARD)
+
+    def fall_back_to_stp(self):
+        """ A legacy bridge is on the link: stop sending RST BPDUs
+             and use the STP timers until the link goes down. """
+        self.logger.info('[port=%d] Legacy STP bridge detected.',
+                         self.ofport.port_no, extra=self.dpid_str)
+        self.rstp = False
+
     def _update_wait_bpdu_timer(self):
-        if self.wait_timer_event is not None:
-            self.wait_timer_event.set()
-            self.wait_timer_event = None
+        if self.wait_bpdu_timer is not None:
+            self._start_wait_bpdu_timer()
             self.logger.debug('[port=%d] Wait BPDU timer is updated.',
                               self.ofport.port_no, extra=self.dpid_str)
-        hub.sleep(0)  # For thread switching.
-
-    def _wait_bpdu_timer(self):
-        time_exceed = False
-
-        while True:
-            self.wait_timer_event = hub.Event()
-            message_age = (self.designated_times.message_age
-                           if self.designated_times else 0)
-            timer = self.port_times.max_age - message_age
-            timeout = hub.Timeout(timer)
-            try:
-                self.wait_timer_event.wait()
-            except hub.Timeout as t:
-                if t is not timeout:
-                    err_msg = 'Internal error. Not my timeout.'
-                    raise RyuException(msg=err_msg)
-                self.logger.info('[port=%d] Wait BPDU timer is exceeded.',
-                                 self.ofport.port_no, extra=self.dpid_str)
-                time_exceed = True
-            finally:
-                timeout.cancel()
-                self.wait_timer_event = None
-
-            if time_exceed:
-                break
 
-        if time_exceed:  # Bridge.recalculate_spanning_tree
-            hub.spawn(self.wait_bpdu_timeout)
+    def _start_wait_bpdu_timer(self):
+        if self.wait_bpdu_timer is not None:
+            self.wait_bpdu_timer.cancel()
+        message_age = (self.designated_times.message_age
+                       if self.designated_times else 0)
+        timer = self.port_times.max_age - message_age
+        self.wait_bpdu_timer = self.scheduler.schedule(
+            timer, self._wait_bpdu_timeout)
+
+    def _wait_bpdu_timeout(self):
+        self.wait_bpdu_timer = None
+        self.logger.info('[port=%d] Wait BPDU timer is exceeded.',
+                         self.ofport.port_no, extra=self.dpid_str)
+        # Bridge.recalculate_spanning_tree
+        hub.spawn(self.wait_bpdu_timeout)
 
     def _transmit_bpdu(self):
-        while True:
-            # Send config BPDU packet if port role is DESIGNATED_PORT.
-            if self.role == DESIGNATED_PORT:
-                now = datetime.datetime.today()
-                if self.send_tc_timer and self.send_tc_timer < now:
-                    self.send_tc_timer = None
-                    self.send_tc_flg = False
-
-                if not self.send_tc_flg:
-                    flags = 0b00000000
-                    log_msg = '[port=%d] Send Config BPDU.'
-                else:
-                    flags = 0b00000001
-                    log_msg = '[port=%d] Send TopologyChange BPDU.'
-                bpdu_data = self._generate_config_bpdu(flags)
-                self.ofctl.send_packet_out(self.ofport.port_no, bpdu_data)
-                self.logger.debug(log_msg, self.ofport.port_no,
-                                  extra=self.dpid_str)
-
-            # Send Topology Change Notification BPDU until receive Ack.
-            if self.send_tcn_flg:
-                bpdu_data = self._generate_tcn_bpdu()
-                self.ofctl.send_packet_out(self.ofport.port_no, bpdu_data)
-                self.logger.debug('[port=%d] Send TopologyChangeNotify BPDU.',
-                                  self.ofport.port_no, extra=self.dpid_str)
+        # Send again after hello time.
+        self.send_bpdu_timer = self.scheduler.schedule(
+            self.port_times.hello_time, self._transmit_bpdu)
+
+        # Send config BPDU packet if port role is DESIGNATED_PORT.
+        if self.role == DESIGNATED_PORT:
+            self.transmit_config_bpdu()
+
+        # Send Topology Change Notification BPDU until receive Ack.
+        if self.send_tcn_flg:
+            bpdu_data = self._generate_tcn_bpdu()
+            self.ofctl.send_packet_out(self.ofport.port_no, bpdu_data)
+            self.logger.debug('[port=%d] Send TopologyChangeNotify BPDU.',
+                              self.ofport.port_no, extra=self.dpid_str)
+
+    def transmit_config_bpdu(self):
+        """ Send Config BPDU (RST BPDU if the port is running RSTP). """
+        now = datetime.datetime.today()
+        if self.send_tc_timer and self.send_tc_timer < now:
+            self.send_tc_timer = None
+            self.send_tc_flg = False
 
-            hub.sleep(self.port_times.hello_time)
+        if not self.send_tc_flg:
+            flags = 0b00000000
+            log_msg = '[port=%d] Send Config BPDU.'
+        else:
+            flags = 0b00000001
+            log_msg = '[port=%d] Send TopologyChange BPDU.'
+        if self.rstp:
+            flags |= self._rst_flags()
+            if flags & RSTP_FLAG_PROPOSAL:
+                log_msg = '[port=%d] Send proposal.'
+        bpdu_data = self._generate_config_bpdu(flags)
+        self.ofctl.send_packet_out(self.ofport.port_no, bpdu_data)
+        self.logger.debug(log_msg, self.ofport.port_no,
+                          extra=self.dpid_str)
 
     def transmit_tc_bpdu(self):
         """ Set send_tc_flg to send Topology Change BPDU. """
@@ -1029,22 +1823,85 @@ class Port(object):
     def transmit_ack_bpdu(self):
         """ Send Topology Change Ack BPDU. """
         ack_flags = 0b10000001
+        if self.rstp:
+            ack_flags |= self._rst_flags()
         bpdu_data = self._generate_config_bpdu(ack_flags)
         self.ofctl.send_packet_out(self.ofport.port_no, bpdu_data)
 
+    def transmit_agreement_bpdu(self):
+        """ (RSTP) Send agreement BPDU, answering the proposal
+             received on a ROOT_PORT, ALTERNATE_PORT or BACKUP_PORT. """
+        if not self.rstp:
+            return
+        flags = RSTP_FLAG_AGREEMENT | self._rst_flags()
+        bpdu_data = self._generate_config_bpdu(flags)
+        self.ofctl.send_packet_out(self.ofport.port_no, bpdu_data)
+        self.logger.debug('[port=%d] Send agreement.',
+                          self.ofport.port_no, extra=self.dpid_str)
+
+    def _rst_flags(self):
+        """ RST BPDU flags describing the role and state of the port. """
+        if self.role is ROOT_PORT:
+            role = RSTP_ROLE_ROOT
+        elif self.role is DESIGNATED_PORT:
+            role = RSTP_ROLE_DESIGNATED
+        else:
+            role = RSTP_ROLE_ALTERNATE_BACKUP
+        flags = role << RSTP_ROLE_SHIFT
+
+        if self.state is PORT_STATE_FORWARD:
+            flags |= RSTP_FLAG_LEARNING | RSTP_FLAG_FORWARDING
+        elif self.state is PORT_STATE_LEARN:
+            flags |= RSTP_FLAG_LEARNING
+        if (self.role is DESIGNATED_PORT
+                and (self.state is PORT_STATE_LISTEN
+                     or self.state is PORT_STATE_LEARN)):
+            flags |= RSTP_FLAG_PROPOSAL
+        return flags
+
     def transmit_tcn_bpdu(self):
         self.send_tcn_flg = True
 
     def _generate_config_bpdu(self, flags):
+        """ Generate a Configuration BPDU, or a RST BPDU
+             if the port is running RSTP.
+             The frame is copied from a template, only the flags and
+             the message age are patched. """
+        key = (self.rstp,
+               self.port_priority.root_id.value,
+               self.port_priority.root_path_cost,
+               self.bridge_id.value,
+               self.port_id.value,
+               self.port_times.max_age,
+               self.port_times.hello_time,
+               self.port_times.forward_delay)
+        if key != self.config_bpdu_key:
+            self.config_bpdu_template = self._build_config_bpdu()
+            self.config_bpdu_key = key
+
+        data = bytearray(self.config_bpdu_template)
+        data[BPDU_FLAGS_OFFSET] = flags
+        message_age = self.port_times.message_age + 1
+        BPDU_TIMER.pack_into(
+            data, BPDU_MESSAGE_AGE_OFFSET,
+            bpdu.ConfigurationBPDUs._encode_timer(message_age))
+        return data
+
+    def _build_config_bpdu(self):
+        """ Build the Config BPDU template of the port,
+             with no flags and a zero message age. """
         src_mac = self.ofport.hw_addr
         dst_mac = bpdu.BRIDGE_GROUP_ADDRESS
+        bpdu_cls = bpdu.RstBPDUs if self.rstp else bpdu.ConfigurationBPDUs
         length = (bpdu.bpdu._PACK_LEN + bpdu.ConfigurationBPDUs.PACK_LEN
                   + llc.llc._PACK_LEN + llc.ControlFormatU._PACK_LEN)
+        if self.rstp:
+            length += bpdu.RstBPDUs.PACK_LEN
 
         e = ethernet.ethernet(dst_mac, src_mac, length)
         l = llc.llc(llc.SAP_BPDU, llc.SAP_BPDU, llc.ControlFormatU())
-        b = bpdu.ConfigurationBPDUs(
-            flags=flags,
+        b = bpdu_cls(
+            flags=0,
             root_priority=self.port_priority.root_id.priority,
             root_mac_address=self.port_priority.root_id.mac_addr,
             root_path_cost=self.port_priority.root_path_cost + self.path_cost,
@@ -1052,7 +1909,7 @@ class Port(object):
             bridge_mac_address=self.bridge_id.mac_addr,
             port_priority=self.port_id.priority,
             port_number=self.ofport.port_no,
-            message_age=self.port_times.message_age + 1,
+            message_age=0,
             max_age=self.port_times.max_age,
             hello_time=self.port_times.hello_time,
             forward_delay=self.port_times.forward_delay)
@@ -1066,6 +1923,13 @@ class Port(object):
         return pkt.data
 
     def _generate_tcn_bpdu(self):
+        """ Generate a Topology Change Notification BPDU.
+             It never changes, so it is built once. """
+        if self.tcn_bpdu is None:
+            self.tcn_bpdu = self._build_tcn_bpdu()
+        return self.tcn_bpdu
+
+    def _build_tcn_bpdu(self):
         src_mac = self.ofport.hw_addr
         dst_mac = bpdu.BRIDGE_GROUP_ADDRESS
         length = (bpdu.bpdu._PACK_LEN
@@ -1085,64 +1949,80 @@ class Port(object):
         return pkt.data
 
 
-class PortThread(object):
-    def __init__(self, function):
-        super(PortThread, self).__init__()
-        self.function = function
-        self.thread = None
+class BridgeId(collections.namedtuple('BridgeId',
+                                      ['priority', 'system_id_extension',
+                                       'mac_addr', 'value'])):
+    """ Bridge ID. 'value' is the encoded ID, used for comparisons. """
+    __slots__ = ()
 
-    def start(self):
-        self.stop()
-        self.thread = hub.spawn(self.function)
+    def __new__(cls, priority, system_id_extension, mac_addr):
+        value = bpdu.ConfigurationBPDUs.encode_bridge_id(
+            priority, system_id_extension, mac_addr)
+        return super(BridgeId, cls).__new__(cls, priority,
+                                            system_id_extension,
+                                            mac_addr, value)
 
-    def stop(self):
-        if self.thread is not None:
-            hub.kill(self.thread)
-            hub.joinall([self.thread])
-            self.thread = None
 
+class PortId(collections.namedtuple('PortId',
+                                    ['priority', 'port_no', 'value'])):
+    """ Port ID. 'value' is the encoded ID, used for comparisons. """
+    __slots__ = ()
 
-class BridgeId(object):
-    def __init__(self, priority, system_id_extension, mac_addr):
-        super(BridgeId, self).__init__()
-        self.priority = priority
-        self.system_id_extension = system_id_extension
-        self.mac_addr = mac_addr
-        self.value = bpdu.ConfigurationBPDUs.encode_bridge_id(
-            priority, system_id_extension, mac_addr)
+    def __new__(cls, priority, port_no):
+        value = bpdu.ConfigurationBPDUs.encode_port_id(priority, port_no)
+        return super(PortId, cls).__new__(cls, priority, port_no, value)
 
 
-class PortId(object):
-    def __init__(self, priority, port_no):
-        super(PortId, self).__init__()
-        self.priority = priority
-        self.port_no = port_no
-        self.value = bpdu.ConfigurationBPDUs.encode_port_id(priority, port_no)
+class Priority(collections.namedtuple('Priority',
+                                      ['root_id', 'root_path_cost',
+                                       'designated_bridge_id',
+                                       'designated_port_id', 'key'])):
+    """ Priority vector. 'key' is the tuple of the values compared to
+         find the best priority, the lowest one:
+         (root ID, root path cost, designated bridge ID, designated port ID)
+         The priority of a root bridge has no designated IDs,
+         so its key is lower than the keys of its own BPDUs. """
+    __slots__ = ()
 
+    def __new__(cls, root_id, root_path_cost,
+                designated_bridge_id, designated_port_id):
+        key = (root_id.value, root_path_cost)
+        if designated_bridge_id is not None:
+            key += (designated_bridge_id.value, designated_port_id.value)
+        return super(Priority, cls).__new__(cls, root_id, root_path_cost,
+                                            designated_bridge_id,
+                                            designated_port_id, key)
 
-class Priority(object):
-    def __init__(self, root_id, root_path_cost,
-                 designated_bridge_id, designated_port_id):
-        super(Priority, self).__init__()
-        self.root_id = root_id
-        self.root_path_cost = root_path_cost
-        self.designated_bridge_id = designated_bridge_id
-        self.designated_port_id = designated_port_id
 
+Times = collections.namedtuple('Times', ['message_age', 'max_age',
+                                         'hello_time', 'forward_delay'])
 
-class Times(object):
-    def __init__(self, message_age, max_age, hello_time, forward_delay):
-        super(Times, self).__init__()
-        self.message_age = message_age
-        self.max_age = max_age
-        self.hello_time = hello_time
-        self.forward_delay = forward_delay
+
+# Spanning tree of a bridge saved by Bridge.save_tree().
+BridgeTree = collections.namedtuple('BridgeTree', ['root_priority',
+                                                   'root_times', 'ports'])
+PortTree = collections.namedtuple('PortTree', ['role', 'state',
+                                               'designated_priority',
+                                               'designated_times'])
 
 
 class OfCtl_v1_0(object):
+    """ OpenFlow messages of the STP library to a switch.
+        The config of each port and the flows of the library are
+         shadowed, so that only the messages changing the state of
+         the switch are sent: e.g. LISTEN and LEARN have the same
+         config, and a port brought up again often keeps its state. """
+
     def __init__(self, dp):
         super(OfCtl_v1_0, self).__init__()
         self.dp = dp
+        # Last config sent for each port number
+        self.port_config = {}
+
+    def forget_port(self, port_no):
+        """ The state of a port on the switch is not known anymore,
+             e.g. the port was added or deleted. """
+        self.port_config.pop(port_no, None)
 
     def send_packet_out(self, out_port, data):
         actions = [self.dp.ofproto_parser.OFPActionOutput(out_port, 0)]
@@ -1151,12 +2031,15 @@ class OfCtl_v1_0(object):
                                 actions=actions, data=data)
 
     def set_port_status(self, port, state):
+        config = PORT_CONFIG_V1_0[state]
+        if self.port_config.get(port.port_no) == config:
+            return
         ofproto_parser = self.dp.ofproto_parser
         mask = 0b1111111
         msg = ofproto_parser.OFPPortMod(self.dp, port.port_no, port.hw_addr,
-                                        PORT_CONFIG_V1_0[state], mask,
-                                        port.advertised)
+                                        config, mask, port.advertised)
         self.dp.send_msg(msg)
+        self.port_config[port.port_no] = config
 
 
 class OfCtl_v1_2later(OfCtl_v1_0):
@@ -1166,18 +2049,28 @@ class OfCtl_v1_2later(OfCtl_v1_0):
     def set_port_status(self, port, state):
         ofp = self.dp.ofproto
         parser = self.dp.ofproto_parser
-        config = {ofproto_v1_2: PORT_CONFIG_V1_2,
-                  ofproto_v1_3: PORT_CONFIG_V1_3}
+        configs = {ofproto_v1_2: PORT_CONFIG_V1_2,
+                   ofproto_v1_3: PORT_CONFIG_V1_3}
+        config = configs[ofp][state]
+        old_config = self.port_config.get(port.port_no)
+        if old_config == config:
+            return
 
         # Only turn on the relevant bits defined on OpenFlow 1.2+, otherwise
         # some switch that follows the specification strictly will report
         # OFPPMFC_BAD_CONFIG error.
         mask = 0b1100101
         msg = parser.OFPPortMod(self.dp, port.port_no, port.hw_addr,
-                                config[ofp][state], mask, port.advertised)
+                                config, mask, port.advertised)
         self.dp.send_msg(msg)
+        self.port_config[port.port_no] = config
 
-        if config[ofp][state] & ofp.OFPPC_NO_PACKET_IN:
+        # The no packet-in flow follows the NO_PACKET_IN bit.
+        no_pkt_in = config & ofp.OFPPC_NO_PACKET_IN
+        if (old_config is not None
+                and no_pkt_in == old_config & ofp.OFPPC_NO_PACKET_IN):
+            return
+        if no_pkt_in:
             self.add_no_pkt_in_flow(port.port_no)
         else:
             self.del_no_pkt_in_flow(port.port_no)
@@ -1,37 +1,111 @@
 import json
-import requests
-import time
+import collections
 import utils
+import hub
+import slice_jobs
+import slice_planner
 from webob import Response
 from ryu.controller.handler import MAIN_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
+from ryu.ofproto import ofproto_v1_3_parser
 from ryu.lib.packet import ether_types
 from ryu.lib import dpid as dpid_lib
 import stplib
 from ryu.lib.packet import packet
 from ryu.lib.packet import ethernet
 from ryu.app.wsgi import ControllerBase, WSGIApplication, route
+from ryu.controller import conf_switch
 from ryu.controller import dpset
+from ryu.controller import ofp_event
+from ryu.topology import event as topo_event
 from ryu.app.simple_switch_13 import SimpleSwitch13
 from events_handler import EventsHandler
+from qos_backend import InProcessQoSBackend
+from send_batcher import SendBatcher
+from topology_index import TopologyIndex
 
 switch_instance_name = 'switch_api_app'
 """Switch application name, used to link the REST API controller to the switch"""
 
-_PORTNO_LEN = 8
-"""Port Number length"""
-
 url = '/api/v1'
 """Base URL for the REST API"""
 
+FLOW_PRIORITY = 1
+"""Priority of the learned flows installed by the switch"""
+
+PROACTIVE_FLOW_PRIORITY = 2
+"""Priority of the flows installed in proactive mode, see SimpleSwitch13.install_proactive_flows"""
+
+FLOW_IDLE_TIMEOUT = 30
+"""Seconds of inactivity after which a learned flow is removed by the switch"""
+
+FLOW_HARD_TIMEOUT = 300
+"""Seconds after which a learned flow is removed by the switch, even if active"""
+
+FLOW_COOKIE = 0x51 << 56
+"""Cookie tag in the highest byte of every flow installed by the switch"""
+
+FLOW_COOKIE_MASK = 0xff << 56
+"""Cookie mask selecting every flow installed by the switch, whatever the slice and generation"""
+
+PROACTIVE_FLOW_COOKIE = 1 << 55
+"""Cookie bit set on the flows installed in proactive mode"""
+
+LEARNED_FLOW_COOKIE_MASK = FLOW_COOKIE_MASK | PROACTIVE_FLOW_COOKIE
+"""Cookie mask selecting the learned flows installed by the switch, leaving out the proactive ones"""
+
+FLOW_GENERATION_COOKIE_MASK = 0xffffffffffffffff & ~PROACTIVE_FLOW_COOKIE
+"""Cookie mask selecting the flows, learned and proactive, installed for a single slice generation"""
+
+def make_flow_cookie(slice_index, generation):
+    """Build the cookie of the flows installed while a slice is active
+
+    The cookie is made of the FLOW_COOKIE tag, the PROACTIVE_FLOW_COOKIE bit (set by the caller
+    on proactive flows), the slice index (bits 32-54, 0 when no slice is active) and the
+    generation of the slice (bits 0-31), increased at each activation.
+
+    Args:
+        slice_index: The index of the slice, 0 if no slice is active
+        generation: The generation of the slice
+    """
+    return FLOW_COOKIE | ((slice_index & 0x7fffff) << 32) | (generation & 0xffffffff)
+
+def make_failover_group_id(out_port, backup_port):
+    """Build the ID of the fast failover group sending packets to a port, or to a backup port when it is down
+
+    Args:
+        out_port: The port used while it is live (bits 16-31)
+        backup_port: The port used when out_port is down (bits 0-15)
+    """
+    return ((out_port & 0xffff) << 16) | (backup_port & 0xffff)
+
+PROACTIVE_UPDATE_DELAY = 0.1
+"""Seconds waited after a port state change before updating the proactive flows, so that the changes
+of a reconvergence are handled at once"""
+
+TOPOLOGY_CHANGE_HOLD_TIME = 2
+"""Seconds after a MAC flush during which the topology changes of the same switch are collapsed into one flush,
+one hello time, so that the TC BPDUs repeated while a topology change lasts do not flush the table every time"""
+
+QOS_TIMEOUT = 10
+"""Maximum number of seconds waited for the QoS configuration of the switches"""
+
+PACKET_IN_BUFFER_SIZE = 256
+"""Maximum number of packet ins buffered per switch while a slice is being applied"""
+
+SliceEntry = collections.namedtuple('SliceEntry', ['out_ports', 'flood_actions', 'output_actions'])
+"""Compiled slice rule for an input port: the allowed output ports, the actions
+flooding a packet to all of them and, for each of them, the actions sending a packet there"""
+
 class SimpleSwitch13(SimpleSwitch13):
     """Base Switch class, called via ryu-manager"""
 
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
     """OpenFlow protocol version"""
 
-    _CONTEXTS = {'stplib': stplib.Stp, 'wsgi': WSGIApplication, 'dpset': dpset.DPSet}
+    _CONTEXTS = {'stplib': stplib.Stp, 'wsgi': WSGIApplication, 'dpset': dpset.DPSet,
+                 'conf_switch': conf_switch.ConfSwitchSet}
     """Contexts that this Ryu application wants to use."""
 
     def __init__(self, *args, **kwargs):
@@ -45,14 +119,11 @@ class SimpleSwitch13(SimpleSwitch13):
         self.dpset = kwargs['dpset']
         """Manage switches"""
 
-        self.switches = []
-        """List of switches in the network"""
+        self.topology = TopologyIndex()
+        """Switches, hosts and links of the network, updated from the ryu.topology events"""
 
-        self.hosts = []
-        """List of hosts in the network"""
-        
-        self.links = []
-        """List of links in the network"""
+        self.slice_graph = None
+        """Links and host ports of the network with the version of the topology they come from, see get_slice_graph"""
 
         self.mac_to_port = {}
         """Dictionary of MAC addresses to port numbers"""
@@ -66,9 +137,44 @@ class SimpleSwitch13(SimpleSwitch13):
         self.stp = kwargs['stplib']
         """Spanning Tree Protocol instance"""
 
+        self.spanning_tree_ports = None
+        """Ports enabled by the last update of the spanning tree, dpid -> set of port numbers,
+        None for every port, see update_spanning_tree"""
+
         self.slicing = False
         """Whether there is a slice currently activating"""
 
+        self.install_flows = True
+        """Whether learned flows are installed on the switches, instead of forwarding every packet with a PacketOut"""
+
+        self.proactive = False
+        """Whether the flows between every pair of known hosts are installed as soon as a slice is applied,
+        and kept following the spanning tree"""
+
+        self.proactive_flows = {}
+        """Proactive flows installed for the current slice, (dpid, in_port, source MAC, destination MAC) ->
+        (out_port, backup out_port or None), see install_proactive_flows"""
+
+        self.proactive_update_pending = False
+        """Whether an update of the proactive flows is scheduled, see schedule_proactive_update"""
+
+        self.fast_failover = False
+        """Whether the flows between known hosts output through fast failover groups, so that the switches
+        move their traffic to a backup path as soon as a link goes down, see compute_failover_flows"""
+
+        self.failover_flows = {}
+        """Flows between the known hosts over the current slice with their backup port, see compute_failover_flows"""
+
+        self.failover_groups = {}
+        """Fast failover groups installed on each switch, by dpid, as (datapath, set of group IDs)"""
+
+        self.batch_sends = True
+        """Whether the messages sent to a switch during a hub tick are written at once, see send_batcher"""
+
+        self.pending_mac_flushes = {}
+        """Ports whose MAC addresses are to be flushed at the end of the hold time of each switch, by dpid,
+        None for every port, see TOPOLOGY_CHANGE_HOLD_TIME"""
+
         self.no_slice_configuration = {
             "1": {"1": [2,3,4,5], "2": [1,3,4,5], "3": [1,2,4,5], "4": [1,2,3,5], "5": [1,2,3,4]},
             "2": {"1": [2,3,4,5], "2": [1,3,4,5], "3": [1,2,4,5], "4": [1,2,3,5], "5": [1,2,3,4]},
@@ -81,19 +187,56 @@ class SimpleSwitch13(SimpleSwitch13):
         self.slice_to_port = self.no_slice_configuration
         """Current slice configuration"""
 
+        self.slice_table = self.compile_slice(self.slice_to_port)
+        """Current slice configuration compiled for the packet in handler, see compile_slice"""
+
+        self.flow_generation = 0
+        """Number of slice configurations applied so far"""
+
+        self.flow_cookie = make_flow_cookie(0, self.flow_generation)
+        """Cookie of the flows installed for the current slice configuration"""
+
         self.events_handler = EventsHandler(self.send_event, "wstopology")
         """Events handler instance, used to send events to the WSTopology application"""
 
+        self.qos = InProcessQoSBackend(kwargs['conf_switch'])
+        """QoS backend, configuring queues and QoS rules through the rest_qos application of this process"""
+
+        self.qos_timeout = QOS_TIMEOUT
+        """Maximum number of seconds waited for the QoS configuration of the switches"""
+
+        self.barrier_waiters = {}
+        """Events set when a barrier reply is received, by (dpid, xid) of the barrier request"""
+
+        self.packet_in_buffer = {}
+        """Packet ins received while a slice is being applied, by dpid, replayed once it is applied"""
+
+        self.packet_in_drops = {}
+        """Number of packet ins dropped because the buffer of the switch was full, by dpid"""
+
+        self.centralized_stp = False
+        """Whether the spanning tree is computed by the controller from the discovered links instead of
+        exchanging BPDUs, see stplib.PROTOCOL_CENTRALIZED"""
+
+        self.jobs = slice_jobs.JobManager(lambda job: self.events_handler.send_job_progress(job.to_dict()))
+        """Job manager applying the slices one at a time, reporting their progress to the WSTopology application"""
+
+        protocol = stplib.PROTOCOL_CENTRALIZED if self.centralized_stp else stplib.PROTOCOL_RSTP
         config = {dpid_lib.str_to_dpid('0000000000000001'):
-                  {'bridge': {'priority': 0x8000, 'fwd_delay': 8}},
+                  {'bridge': {'priority': 0x8000, 'fwd_delay': 8,
+                              'protocol': protocol}},
                   dpid_lib.str_to_dpid('0000000000000002'):
-                  {'bridge': {'priority': 0x9000, 'fwd_delay': 8}},
+                  {'bridge': {'priority': 0x9000, 'fwd_delay': 8,
+                              'protocol': protocol}},
                   dpid_lib.str_to_dpid('0000000000000003'):
-                  {'bridge': {'priority': 0xa000, 'fwd_delay': 8}},
+                  {'bridge': {'priority': 0xa000, 'fwd_delay': 8,
+                              'protocol': protocol}},
                   dpid_lib.str_to_dpid('0000000000000004'):
-                  {'bridge': {'priority': 0xb000, 'fwd_delay': 8}},
+                  {'bridge': {'priority': 0xb000, 'fwd_delay': 8,
+                              'protocol': protocol}},
                   dpid_lib.str_to_dpid('0000000000000005'):
-                  {'bridge': {'priority': 0xc000, 'fwd_delay': 8}}}
+                  {'bridge': {'priority': 0xc000, 'fwd_delay': 8,
+                              'protocol': protocol}}}
         """STP configuration"""
 
         # Register the STP configuration
@@ -105,7 +248,7 @@ class SimpleSwitch13(SimpleSwitch13):
         # Register the REST API
         wsgi.register(SwitchController, {switch_instance_name: self})
     
-    def add_flow(self, datapath, priority, match, actions, buffer_id=None):
+    def add_flow(self, datapath, priority, match, actions, buffer_id=None, idle_timeout=0, hard_timeout=0, cookie=0):
         """Add a flow to the switch
 
         This function is a modified version of the one in simple_switch_13.py.
@@ -118,6 +261,9 @@ class SimpleSwitch13(SimpleSwitch13):
             match: The match of the flow, a dictionary of fields and values
             actions: The actions of the flow, a list of dictionaries of fields and values
             buffer_id: The buffer ID of the flow, if any
+            idle_timeout: Seconds of inactivity before the flow expires, 0 to never expire
+            hard_timeout: Seconds before the flow expires, 0 to never expire
+            cookie: The cookie of the flow, used to delete it later
         """
 
         ofproto = datapath.ofproto
@@ -127,100 +273,466 @@ class SimpleSwitch13(SimpleSwitch13):
                                              actions)]
         if buffer_id:
             mod = parser.OFPFlowMod(datapath=datapath, table_id=1, buffer_id=buffer_id,
-                                    priority=priority, match=match,
+                                    cookie=cookie, priority=priority, match=match,
+                                    idle_timeout=idle_timeout, hard_timeout=hard_timeout,
                                     instructions=inst)
         else:
-            mod = parser.OFPFlowMod(datapath=datapath, table_id=1, priority=priority,
-                                    match=match, instructions=inst)
+            mod = parser.OFPFlowMod(datapath=datapath, table_id=1, cookie=cookie, priority=priority,
+                                    match=match, idle_timeout=idle_timeout,
+                                    hard_timeout=hard_timeout, instructions=inst)
         datapath.send_msg(mod)
 
-    def delete_flow(self, datapath):
-        """Delete a from from the switch"""
+    def delete_flow(self, datapath, cookie=FLOW_COOKIE, cookie_mask=FLOW_COOKIE_MASK,
+                    out_port=ofproto_v1_3.OFPP_ANY, out_group=ofproto_v1_3.OFPG_ANY):
+        """Delete the flows installed by the switch
+
+        A single cookie-masked flow_mod removes the flows, whatever the number of learned
+        MAC addresses, and it is followed by a barrier so that the switch processes
+        the deletion before any later flow_mod.
+
+        Args:
+            datapath: The switch to delete the flows from
+            cookie: The cookie of the flows to delete, by default every flow installed by the switch
+            cookie_mask: The bits of the cookie that must match
+            out_port: Only delete the flows sending packets to this port, by default any
+            out_group: Only delete the flows sending packets to this group, by default any
+        """
 
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
-        for dst in self.mac_to_port[datapath.id].keys():
-            match = parser.OFPMatch(eth_dst=dst)
-            mod = parser.OFPFlowMod(
-                datapath, command=ofproto.OFPFC_DELETE,
-                out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY,
-                priority=1, match=match, table_id=1)
-            datapath.send_msg(mod)
+        mod = parser.OFPFlowMod(
+            datapath, cookie=cookie, cookie_mask=cookie_mask,
+            command=ofproto.OFPFC_DELETE, table_id=1,
+            out_port=out_port, out_group=out_group,
+            match=parser.OFPMatch())
+        datapath.send_msg(mod)
+        datapath.send_barrier()
+
+    def flush_flows(self):
+        """Delete the flows of the current slice from every switch and forget the learned MAC addresses
+
+        Called when the active slice changes, so that no flow installed under the
+        previous slice keeps forwarding traffic on ports that are no longer allowed.
+        """
+
+        for _, datapath in self.dpset.get_all():
+            self.delete_flow(datapath, self.flow_cookie, FLOW_GENERATION_COOKIE_MASK)
+        self.mac_to_port = {}
+        self.failover_flows = {}
+        self.proactive_flows = {}
+
+    @staticmethod
+    def compile_slice(slice_to_port):
+        """Compile a slice configuration into the structure used on every packet in
+
+        The slice templates are JSON-shaped (string keys, lists of ports). They are turned once
+        into a dictionary dpid -> in_port -> SliceEntry with integer keys, frozensets of output
+        ports and pre-built OFPActionOutput lists, so that forwarding a packet needs no string
+        conversion nor allocation.
+
+        Args:
+            slice_to_port: The slice configuration, as stored in the slice templates
+        """
+
+        parser = ofproto_v1_3_parser
+        slice_table = {}
+        for dpid, ports in slice_to_port.items():
+            port_table = slice_table.setdefault(int(dpid), {})
+            for in_port, out_ports in ports.items():
+                out_ports = [int(out) for out in out_ports]
+                port_table[int(in_port)] = SliceEntry(
+                    frozenset(out_ports),
+                    [parser.OFPActionOutput(out) for out in out_ports],
+                    {out: [parser.OFPActionOutput(out)] for out in out_ports})
+        return slice_table
+
+    def set_slice(self, slice_to_port, slice_index=0):
+        """Set the current slice configuration, compiling it for the packet in handler
+
+        A new flow generation starts, so that the flows installed from now on can be
+        deleted all at once when the slice changes again.
+
+        Args:
+            slice_to_port: The slice configuration, as stored in the slice templates
+            slice_index: The index of the slice template, 0 if no slice is active
+        """
+
+        self.slice_table = self.compile_slice(slice_to_port)
+        self.slice_to_port = slice_to_port
+        self.flow_generation += 1
+        self.flow_cookie = make_flow_cookie(slice_index, self.flow_generation)
 
     @set_ev_cls(stplib.EventPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
         """Handle packet in messages from the switch, learning the MAC address of the source.
         Eventually the packet is forwarded to the destination, or flooded.
+        While a slice is being applied, the packet ins are buffered and replayed afterwards.
 
         Args:
             ev: The EventPacketIn object
         """
-        if not self.slicing:
-            msg = ev.msg
-            datapath = msg.datapath
-            ofproto = datapath.ofproto
-            parser = datapath.ofproto_parser
-            in_port = msg.match['in_port']
+        if self.slicing:
+            self.buffer_packet_in(ev)
+        else:
+            self.forward_packet_in(ev)
+
+    def forward_packet_in(self, ev):
+        """Forward the packet of a packet in message according to the current slice
+
+        Args:
+            ev: The EventPacketIn object
+        """
+        msg = ev.msg
+        datapath = msg.datapath
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        in_port = msg.match['in_port']
 
+        # The Ethernet header is already decoded by stplib
+        eth = ev.eth
+        if eth is None:
             pkt = packet.Packet(msg.data)
             eth = pkt.get_protocols(ethernet.ethernet)[0]
 
-            dst = eth.dst
-            src = eth.src
+        dst = eth.dst
+        src = eth.src
 
-            # Ignore LLDP packets - they are used for topology discovery
-            if eth.ethertype == ether_types.ETH_TYPE_LLDP:
-                return
+        # Ignore LLDP packets - they are used for topology discovery
+        if eth.ethertype == ether_types.ETH_TYPE_LLDP:
+            return
 
-            dpid = datapath.id
-            self.mac_to_port.setdefault(dpid, {})
+        dpid = datapath.id
+        port_table = self.slice_table.get(dpid)
+        entry = port_table.get(in_port) if port_table is not None else None
 
-            # Check if the slice allows this communication
-            if str(in_port) in self.slice_to_port[str(dpid)]:
-                # Learn a mac address to avoid FLOOD next time.
-                self.mac_to_port[dpid][src] = in_port
+        # Check if the slice allows this communication
+        if entry is not None:
+            # Learn a mac address to avoid FLOOD next time.
+            mac_table = self.mac_to_port.setdefault(dpid, {})
+            mac_table[src] = in_port
 
-                # If the destination is known, send the packet to the destination
-                if dst in self.mac_to_port[dpid] and self.mac_to_port[dpid][dst] in self.slice_to_port[str(dpid)][str(in_port)]:
-                    out_port = [self.mac_to_port[dpid][dst]]
-                else:
-                    # Flood the packet to all possible ports (based on the slice restrictions)
-                    out_port = self.slice_to_port[str(dpid)][str(in_port)]
-
-                # Create the actions list: send the packet to each port in out_port
-                actions = [parser.OFPActionOutput(int(out)) for out in out_port]
+            # If the destination is known, send the packet to the destination
+            out_port = mac_table.get(dst)
+            if out_port in entry.out_ports:
+                actions = self.get_flow_actions(datapath, in_port, src, dst, out_port)
             else:
-                # The slice doesn't allow this communication, no action is taken
-                self.logger.info("Can't communicate due to slice restrictions, switch %s, in_port: %s, slice_to_port %s", dpid, in_port, self.slice_to_port)
-                out = parser.OFPPacketOut(datapath=datapath, buffer_id=msg.buffer_id,
-                                    in_port=in_port, actions=[], data=None)
-                datapath.send_msg(out)
+                # Flood the packet to all possible ports (based on the slice restrictions)
+                actions = entry.flood_actions
+                out_port = None
+
+            # Both ends are known: install a flow so that the next packets don't reach the controller
+            if out_port is not None and self.install_flows:
+                match = parser.OFPMatch(in_port=in_port, eth_src=src, eth_dst=dst)
+                if msg.buffer_id != ofproto.OFP_NO_BUFFER:
+                    # The switch forwards the buffered packet itself once the flow is installed
+                    self.add_flow(datapath, FLOW_PRIORITY, match, actions, msg.buffer_id,
+                                  FLOW_IDLE_TIMEOUT, FLOW_HARD_TIMEOUT, self.flow_cookie)
+                    return
+                self.add_flow(datapath, FLOW_PRIORITY, match, actions,
+                              idle_timeout=FLOW_IDLE_TIMEOUT, hard_timeout=FLOW_HARD_TIMEOUT,
+                              cookie=self.flow_cookie)
+        else:
+            # The slice doesn't allow this communication, no action is taken
+            self.logger.info("Can't communicate due to slice restrictions, switch %s, in_port: %s, slice_to_port %s", dpid, in_port, self.slice_to_port)
+            out = parser.OFPPacketOut(datapath=datapath, buffer_id=msg.buffer_id,
+                                in_port=in_port, actions=[], data=None)
+            datapath.send_msg(out)
+            return
+
+        data = None
+        if msg.buffer_id == ofproto.OFP_NO_BUFFER:
+            data = msg.data
+
+        out = parser.OFPPacketOut(datapath=datapath, buffer_id=msg.buffer_id,
+                                in_port=in_port, actions=actions, data=data)
+        datapath.send_msg(out)
+
+    def buffer_packet_in(self, ev):
+        """Buffer a packet in message received while a slice is being applied
+
+        Each switch has its own buffer of PACKET_IN_BUFFER_SIZE messages. Once it is full,
+        the oldest message is dropped and counted in packet_in_drops.
+
+        Args:
+            ev: The EventPacketIn object
+        """
+        dpid = ev.msg.datapath.id
+        buffer = self.packet_in_buffer.get(dpid)
+        if buffer is None:
+            buffer = self.packet_in_buffer[dpid] = collections.deque(maxlen=PACKET_IN_BUFFER_SIZE)
+        if len(buffer) == buffer.maxlen:
+            self.packet_in_drops[dpid] = self.packet_in_drops.get(dpid, 0) + 1
+        buffer.append(ev)
+
+    def replay_packet_ins(self):
+        """Forward the packet ins buffered while a slice was being applied, according to the new slice"""
+        buffers = self.packet_in_buffer
+        self.packet_in_buffer = {}
+        for dpid, buffer in buffers.items():
+            self.logger.info("[dpid=%s] Replaying %d packet ins (%d dropped so far)",
+                             dpid_lib.dpid_to_str(dpid), len(buffer), self.packet_in_drops.get(dpid, 0))
+            for ev in buffer:
+                self.forward_packet_in(ev)
+
+    def wait_barrier(self, datapath, timeout):
+        """Send a barrier request to a switch and wait for the reply,
+        i.e. until the switch has processed every previous message
+
+        Args:
+            datapath: The switch to send the barrier request to
+            timeout: Maximum number of seconds to wait
+
+        Returns:
+            Whether the switch replied in time
+        """
+
+        req = datapath.ofproto_parser.OFPBarrierRequest(datapath)
+        xid = datapath.set_xid(req)
+        event = hub.Event()
+        self.barrier_waiters[(datapath.id, xid)] = event
+        datapath.send_msg(req)
+        if event.wait(timeout):
+            return True
+        self.barrier_waiters.pop((datapath.id, xid), None)
+        return False
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, MAIN_DISPATCHER)
+    def _state_change_handler(self, ev):
+        """Handle the switches connecting, coalescing the messages sent to them if batch_sends is set
+
+        Args:
+            ev: The EventOFPStateChange object
+        """
+        if self.batch_sends:
+            SendBatcher.install(ev.datapath)
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def _barrier_reply_handler(self, ev):
+        """Handle barrier replies, waking up whoever waits for them
+
+        Args:
+            ev: The EventOFPBarrierReply object
+        """
+        event = self.barrier_waiters.pop((ev.msg.datapath.id, ev.msg.xid), None)
+        if event is not None:
+            event.set()
+
+    def get_slice_qos(self, slice_index):
+        """Get the QoS configurations of a slice template, grouped by switch
+
+        Args:
+            slice_index: The index of the slice template, None if no slice is active
+        """
+
+        qos = {}
+        if slice_index is not None and slice_index > 0:
+            for qos_configuration in self.slice_templates[slice_index-1]["qos"]:
+                qos.setdefault(qos_configuration["switch_id"], []).append(qos_configuration)
+        return qos
+
+    def update_qos(self, old_slice_index, new_slice_index):
+        """Replace the queues and QoS rules of a slice with the ones of another slice
+
+        Only the switches whose QoS configuration differs between the two slices are touched,
+        see slice_planner.plan_qos_changes. Every switch is configured in its own greenthread.
+        Each step waits for the previous one to be completed (OVSDB connection up, barrier reply
+        for the rules) instead of sleeping, and the function returns once every switch is done,
+        or after qos_timeout seconds.
+
+        Args:
+            old_slice_index: The index of the slice currently applied, None if no slice is active
+            new_slice_index: The index of the slice to apply, None to remove every queue and rule
+        """
+
+        changes = slice_planner.plan_qos_changes(self.get_slice_qos(old_slice_index),
+                                                 self.get_slice_qos(new_slice_index))
+
+        threads = [hub.spawn(self._update_switch_qos, dpid, switch_changes)
+                   for dpid, switch_changes in changes.items()]
+        timeout = hub.Timeout(self.qos_timeout)
+        try:
+            hub.joinall(threads)
+        except hub.Timeout as t:
+            if t is not timeout:
+                raise
+            self.logger.error("QoS configuration not completed in %s seconds", self.qos_timeout)
+            for thread in threads:
+                hub.kill(thread)
+        finally:
+            timeout.cancel()
+
+    def _update_switch_qos(self, dpid, changes):
+        """Replace the queues and/or the QoS rules of a switch
+
+        Args:
+            dpid: The datapath ID of the switch
+            changes: The slice_planner.QoSChanges of the switch
+        """
+
+        dpid_str = dpid_lib.dpid_to_str(dpid)
+        if changes.old:
+            if changes.rules:
+                self.logger.info("[dpid=%s] %s", dpid_str, self.qos.delete_rules(dpid))
+            if changes.queues:
+                self.logger.info("[dpid=%s] %s", dpid_str, self.qos.delete_queue(dpid))
+
+        if changes.new and changes.queues:
+            # Queues can only be created once the switch is connected to OVSDB
+            if not (self.qos.set_ovsdb_addr(dpid) and self.qos.wait_ready(dpid, self.qos_timeout)):
+                self.logger.error("[dpid=%s] OVSDB not available, QoS not applied", dpid_str)
                 return
 
-            data = None
-            if msg.buffer_id == ofproto.OFP_NO_BUFFER:
-                data = msg.data
+            for qos_configuration in changes.new:
+                self.logger.info("[dpid=%s] Applying queues: %s", dpid_str, qos_configuration)
+                self.logger.info("[dpid=%s] %s", dpid_str, self.qos.set_queue(dpid, qos_configuration["port_name"], qos_configuration["queues"]))
 
-            out = parser.OFPPacketOut(datapath=datapath, buffer_id=msg.buffer_id,
-                                    in_port=in_port, actions=actions, data=data)
-            datapath.send_msg(out)
+        if changes.new and changes.rules:
+            for qos_configuration in changes.new:
+                for index, match in enumerate(qos_configuration["match"]):
+                    self.logger.info("[dpid=%s] %s", dpid_str, self.qos.add_rule(dpid, match, qos_configuration["queues"][index]["queue"]))
+
+        # The rules are flow_mods: they are installed once the switch answers the barrier
+        datapath = self.dpset.get(dpid)
+        if datapath is not None and not self.wait_barrier(datapath, self.qos_timeout):
+            self.logger.warning("[dpid=%s] No barrier reply after the QoS configuration", dpid_str)
+
+    @set_ev_cls([topo_event.EventSwitchEnter, topo_event.EventSwitchReconnected, topo_event.EventSwitchLeave])
+    def _switch_change_handler(self, ev):
+        """Handle the switches entering, reconnecting to or leaving the network, as seen by ryu.topology
+
+        Args:
+            ev: The EventSwitchEnter, EventSwitchReconnected or EventSwitchLeave object
+        """
+        if isinstance(ev, topo_event.EventSwitchLeave):
+            self.topology.switch_leave(ev.switch)
+        else:
+            self.topology.switch_enter(ev.switch)
+        self.schedule_proactive_update()
+
+    @set_ev_cls([topo_event.EventPortAdd, topo_event.EventPortModify, topo_event.EventPortDelete])
+    def _port_change_handler(self, ev):
+        """Handle the ports added, modified or deleted on the switches, as seen by ryu.topology
+
+        Args:
+            ev: The EventPortAdd, EventPortModify or EventPortDelete object
+        """
+        if isinstance(ev, topo_event.EventPortDelete):
+            self.topology.port_delete(ev.port)
+        else:
+            self.topology.port_add(ev.port)
+
+    @set_ev_cls([topo_event.EventLinkAdd, topo_event.EventLinkDelete])
+    def _link_change_handler(self, ev):
+        """Handle the links discovered or lost by ryu.topology, recomputing the spanning tree in centralized mode
+
+        Args:
+            ev: The EventLinkAdd or EventLinkDelete object
+        """
+        if isinstance(ev, topo_event.EventLinkAdd):
+            self.topology.link_add(ev.link)
+        else:
+            self.topology.link_delete(ev.link)
+
+        if self.centralized_stp:
+            self.stp.set_links(self.get_link_ports())
+        self.schedule_proactive_update()
+
+    @set_ev_cls(topo_event.EventHostAdd)
+    def _host_add_handler(self, ev):
+        """Handle the hosts discovered by ryu.topology, whose ports can forward without waiting for STP
+
+        Args:
+            ev: The EventHostAdd object
+        """
+        self.topology.host_add(ev.host)
+        self.stp.set_edge_port(ev.host.port.dpid, ev.host.port.port_no)
+        self.schedule_proactive_update()
+
+    @set_ev_cls(topo_event.EventHostDelete)
+    def _host_delete_handler(self, ev):
+        """Handle the hosts removed by ryu.topology
+
+        Args:
+            ev: The EventHostDelete object
+        """
+        self.topology.host_delete(ev.host)
+        self.schedule_proactive_update()
+
+    @set_ev_cls(topo_event.EventHostMove)
+    def _host_move_handler(self, ev):
+        """Handle the hosts moved to another port, as seen by ryu.topology
+
+        Args:
+            ev: The EventHostMove object
+        """
+        self.topology.host_add(ev.dst)
+        self.stp.set_edge_port(ev.dst.port.dpid, ev.dst.port.port_no)
+        self.schedule_proactive_update()
 
     @set_ev_cls(stplib.EventTopologyChange, MAIN_DISPATCHER)
     def _topology_change_handler(self, ev):
         """Handle topology change events from the STP library.
 
+        Only the MAC addresses learned on the ports the event reports are flushed. A burst of
+        topology changes (e.g. the TC BPDUs of a reconvergence) is collapsed: the first one is
+        flushed right away, the next ones are merged and flushed once TOPOLOGY_CHANGE_HOLD_TIME later.
+
         Args:
             ev: The EventTopologyChange object
         """
         dp = ev.dp
+        if dp.id in self.pending_mac_flushes:
+            pending = self.pending_mac_flushes[dp.id]
+            if pending is not None and ev.port_nos is not None:
+                self.pending_mac_flushes[dp.id] = pending | ev.port_nos
+            else:
+                self.pending_mac_flushes[dp.id] = None
+            return
+
+        self.flush_mac_table(dp, ev.port_nos)
+        self.pending_mac_flushes[dp.id] = frozenset()
+        hub.spawn_after(TOPOLOGY_CHANGE_HOLD_TIME, self._flush_pending_mac_table, dp)
+
+    def _flush_pending_mac_table(self, dp):
+        """Flush the MAC addresses of the topology changes collapsed during the hold time of a switch"""
+
+        port_nos = self.pending_mac_flushes.pop(dp.id, frozenset())
+        if port_nos is None or port_nos:
+            self.flush_mac_table(dp, port_nos)
+
+    def flush_mac_table(self, dp, port_nos=None):
+        """Forget the MAC addresses learned on ports of a switch and delete the learned flows sending packets there
+
+        Proactive flows follow the slice, not the spanning tree: they are kept.
+
+        Args:
+            dp: The switch
+            port_nos: The port numbers, None for every port
+        """
         dpid_str = dpid_lib.dpid_to_str(dp.id)
-        msg = 'Receive topology change event. Flush MAC table.'
-        self.logger.debug("[dpid=%s] %s", dpid_str, msg)
+        self.logger.debug("[dpid=%s] Receive topology change event. Flush MAC table of ports %s.",
+                          dpid_str, 'all' if port_nos is None else sorted(port_nos))
+
+        mac_table = self.mac_to_port.get(dp.id)
+        if not mac_table:
+            return
 
-        if dp.id in self.mac_to_port:
-            self.delete_flow(dp)
+        if port_nos is None:
+            self.delete_flow(dp, FLOW_COOKIE, LEARNED_FLOW_COOKIE_MASK)
             del self.mac_to_port[dp.id]
+            return
+
+        learned_ports = set(mac_table.values())
+        for port_no in port_nos & learned_ports:
+            self.delete_flow(dp, FLOW_COOKIE, LEARNED_FLOW_COOKIE_MASK, out_port=port_no)
+        # Flows output through fast failover groups have no output port of their own
+        installed = self.failover_groups.get(dp.id)
+        for group_id in sorted(installed[1]) if installed is not None and installed[0] is dp else []:
+            if (group_id >> 16) in port_nos or (group_id & 0xffff) in port_nos:
+                self.delete_flow(dp, FLOW_COOKIE, LEARNED_FLOW_COOKIE_MASK, out_group=group_id)
+        self.mac_to_port[dp.id] = {mac: port_no for mac, port_no in mac_table.items()
+                                   if port_no not in port_nos}
 
     @set_ev_cls(stplib.EventPortStateChange, MAIN_DISPATCHER)
     def _port_state_change_handler(self, ev):
@@ -237,86 +749,552 @@ class SimpleSwitch13(SimpleSwitch13):
                     stplib.PORT_STATE_FORWARD: 'FORWARD'}
         self.logger.debug("[dpid=%s][port=%d] state=%s",
                           dpid_str, ev.port_no, of_state[ev.port_state])
+        self.schedule_proactive_update()
+
+    def schedule_proactive_update(self):
+        """Update the proactive flows and the backup paths PROACTIVE_UPDATE_DELAY from now, once the spanning
+        tree or the topology changed
+
+        The changes arriving meanwhile are handled by the same update.
+        """
+        if not (self.proactive or self.fast_failover) or self.proactive_update_pending:
+            return
+        self.proactive_update_pending = True
+        hub.spawn_after(PROACTIVE_UPDATE_DELAY, self._update_proactive_flows)
+
+    def _update_proactive_flows(self):
+        """Move the proactive flows and the backup paths to the current spanning tree and hosts,
+        see schedule_proactive_update"""
+        if self.slicing:
+            # The slice being applied installs its flows once done
+            hub.spawn_after(PROACTIVE_UPDATE_DELAY, self._update_proactive_flows)
+            return
+        self.proactive_update_pending = False
+        if self.fast_failover:
+            self.failover_flows = self.compute_failover_flows()
+        if self.proactive:
+            self.install_proactive_flows()
     
     def get_switches(self):
-        """Get the list of switches in the network"""
-        
-        if self.switches == []:
-            self.switches = requests.get('http://localhost:8080/v1.0/topology/switches').json()
-        return self.switches
-    
+        """Get the list of switches in the network, in the format of rest_topology"""
+
+        return self.topology.switches_to_dict()
+
     def get_hosts(self):
-        """Get the list of hosts in the network"""
+        """Get the list of hosts in the network, in the format of rest_topology"""
 
-        if self.hosts == []:
-            self.hosts = requests.get('http://localhost:8080/v1.0/topology/hosts').json()
-        return self.hosts
+        return self.topology.hosts_to_dict()
 
     def get_links(self):
-        """Get the list of links in the network"""
+        """Get the list of links in the network, in the format of rest_topology"""
 
-        if self.links == []:
-            self.links = requests.get('http://localhost:8080/v1.0/topology/links').json()
-        return self.links
-    
-    def str_to_port_no(self, port_no_str):
-        """Convert a port number from string to int"""
+        return self.topology.links_to_dict()
+
+    def get_link_ports(self):
+        """Get the links of the network as ((dpid, port_no), (dpid, port_no)) pairs"""
+
+        return set(self.topology.link_ports().items())
+
+    def get_slice_graph(self):
+        """Get the links and the host ports of the network, to compute paths over the slice
+
+        Returns:
+            A tuple (neighbours, host_ports): neighbours maps the (dpid, port_no) of one end of each
+            link to the other end, host_ports maps the (dpid, port_no) of each host to its MAC addresses.
+            They are computed again only when the topology changes.
+        """
+
+        if self.slice_graph is None or self.slice_graph[0] != self.topology.version:
+            self.slice_graph = (self.topology.version, self.topology.link_ports(), self.topology.host_ports())
+        return self.slice_graph[1], self.slice_graph[2]
+
+    def get_forwarding_ports(self):
+        """Get the (dpid, port_no) of the ports the spanning tree currently forwards on"""
+
+        return set((dpid, port_no)
+                   for dpid, bridge in self.stp.bridge_list.items()
+                   for port_no, port in bridge.ports.items()
+                   if port.state == stplib.PORT_STATE_FORWARD)
+
+    @staticmethod
+    def get_forwarding_links(neighbours, forwarding_ports):
+        """Keep the links whose both ends are forwarding: the other ones drop the packets
+
+        Args:
+            neighbours: The links of the network, see get_slice_graph
+            forwarding_ports: The (dpid, port_no) of the forwarding ports, see get_forwarding_ports
+
+        Returns:
+            The forwarding links, in the format of neighbours
+        """
+
+        return {src: dst for src, dst in neighbours.items()
+                if src in forwarding_ports and dst in forwarding_ports}
+
+    def get_backup_links(self, neighbours, failed_port):
+        """Get the links the spanning tree forwards on once a link has failed
+
+        The spanning tree converges to the one computed without the failed link, see
+        stplib.compute_spanning_tree: its root and designated ports are the forwarding ones.
+
+        Args:
+            neighbours: The links of the network, see get_slice_graph
+            failed_port: The (dpid, port_no) of one end of the failed link
+
+        Returns:
+            The links forwarding once the link has failed, in the format of neighbours
+        """
+
+        failed = (failed_port, neighbours.get(failed_port))
+        links = {src: dst for src, dst in neighbours.items() if src not in failed}
+        port_roles = stplib.compute_spanning_tree(self.stp.bridge_list, links.items())
+        forwarding_ports = set((dpid, port_no)
+                               for dpid, roles in port_roles.items()
+                               for port_no, role in roles.items()
+                               if role not in stplib.BLOCKED_PORT_ROLES)
+        return self.get_forwarding_links(links, forwarding_ports)
+
+    def find_slice_paths(self, start, neighbours, host_ports):
+        """Find the shortest path from a (switch, input port) pair to every host reachable over the current slice
+
+        A breadth-first search is run over the (switch, input port) pairs: from each of them, the
+        slice gives the output ports allowed, which lead either to a host or, through a link, to the
+        input port of the next switch. The first time a host is reached gives the shortest path to it.
+
+        Args:
+            start: The (dpid, in_port) pair the packets come from
+            neighbours: The links of the network, see get_slice_graph
+            host_ports: The host ports of the network, see get_slice_graph
+
+        Returns:
+            A dictionary (dpid, port_no) of the host -> hops, where hops is the list of
+            (dpid, in_port, out_port) the packets go through
+        """
+
+        # Visited (dpid, in_port) pairs, with the pair and the output port they were reached from
+        parents = {start: None}
+        queue = collections.deque([start])
+        reached = {}
+        while queue:
+            dpid, in_port = state = queue.popleft()
+            entry = self.slice_table.get(dpid, {}).get(in_port)
+            if entry is None:
+                continue
+            for out_port in sorted(entry.out_ports):
+                port = (dpid, out_port)
+                if port in host_ports and port != start and port not in reached:
+                    reached[port] = (state, out_port)
+                elif port in neighbours and neighbours[port] not in parents:
+                    parents[neighbours[port]] = (state, out_port)
+                    queue.append(neighbours[port])
+
+        paths = {}
+        for dst_port, (state, out_port) in reached.items():
+            hops = []
+            while state is not None:
+                hops.append((state[0], state[1], out_port))
+                if parents[state] is None:
+                    break
+                state, out_port = parents[state]
+            hops.reverse()
+            paths[dst_port] = hops
+        return paths
+
+    def compute_slice_paths(self):
+        """Compute the forwarding path between every pair of known hosts over the current slice
+
+        Only the links the spanning tree forwards on are used.
+
+        Returns:
+            A list of (source MAC, destination MAC, hops) tuples, where hops is the list
+            of (dpid, in_port, out_port) the packets go through
+        """
+
+        neighbours, host_ports = self.get_slice_graph()
+        neighbours = self.get_forwarding_links(neighbours, self.get_forwarding_ports())
+
+        paths = []
+        for src_port, src_macs in host_ports.items():
+            for dst_port, hops in self.find_slice_paths(src_port, neighbours, host_ports).items():
+                for src_mac in src_macs:
+                    for dst_mac in host_ports[dst_port]:
+                        paths.append((src_mac, dst_mac, hops))
+
+        return paths
+
+    def compute_failover_flows(self):
+        """Compute the flows between every pair of known hosts over the current slice, with their backup paths
+
+        The paths follow the links the spanning tree forwards on. For every hop of a path leaving a
+        switch through a link, the path the packets take once that link has failed is computed too,
+        over the links the spanning tree forwards on after the failure, see get_backup_links. The hop
+        then outputs through a fast failover group, see add_failover_group, and the switches of the
+        backup path get the flows it needs, unless they already have one for the same packets.
+
+        The backup path may go through ports the spanning tree blocks until it reacts to the failure:
+        in centralized mode they are unblocked as soon as the switch reports the link down, with
+        STP or RSTP once the tree has converged again. The flows are then computed again over the
+        new tree, see schedule_proactive_update.
+
+        Returns:
+            A dictionary (dpid, in_port, source MAC, destination MAC) -> (out_port, backup out_port or None)
+        """
+
+        neighbours, host_ports = self.get_slice_graph()
+        forwarding_links = self.get_forwarding_links(neighbours, self.get_forwarding_ports())
+
+        # Links forwarding once each link has failed, and the backup paths found over them
+        backup_links = {}
+        backup_paths = {}
+        flows = {}
+        backup_flows = {}
+        for src_port, src_macs in host_ports.items():
+            for dst_port, hops in self.find_slice_paths(src_port, forwarding_links, host_ports).items():
+                for dpid, in_port, out_port in hops:
+                    backup_hops = []
+                    link = (dpid, out_port)
+                    if link in forwarding_links:
+                        if link not in backup_links:
+                            backup_links[link] = self.get_backup_links(neighbours, link)
+                        key = (link, (dpid, in_port))
+                        if key not in backup_paths:
+                            backup_paths[key] = self.find_slice_paths((dpid, in_port), backup_links[link],
+                                                                      host_ports)
+                        backup_hops = backup_paths[key].get(dst_port, [])
+                    backup_port = backup_hops[0][2] if backup_hops and backup_hops[0][2] != in_port else None
+                    for src_mac in src_macs:
+                        for dst_mac in host_ports[dst_port]:
+                            flows[(dpid, in_port, src_mac, dst_mac)] = (out_port, backup_port)
+                            for hop in backup_hops[1:] if backup_port is not None else []:
+                                backup_flows.setdefault((hop[0], hop[1], src_mac, dst_mac), (hop[2], None))
+
+        for key, flow in backup_flows.items():
+            flows.setdefault(key, flow)
+        return flows
+
+    def add_failover_group(self, datapath, out_port, backup_port):
+        """Install the fast failover group sending packets to a port, or to a backup port when its link is down
+
+        The groups only depend on the two ports, so they are installed once per switch and kept
+        across slices.
+
+        Args:
+            datapath: The switch to install the group on
+            out_port: The port used while it is live
+            backup_port: The port used when out_port is down
+
+        Returns:
+            The ID of the group
+        """
+
+        group_id = make_failover_group_id(out_port, backup_port)
+        installed = self.failover_groups.get(datapath.id)
+        if installed is None or installed[0] is not datapath:
+            # New connection of the switch: its groups are unknown
+            installed = self.failover_groups[datapath.id] = (datapath, set())
+        if group_id in installed[1]:
+            return group_id
+
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        buckets = [parser.OFPBucket(watch_port=port, watch_group=ofproto.OFPG_ANY,
+                                    actions=[parser.OFPActionOutput(port)])
+                   for port in (out_port, backup_port)]
+        # Replace the group if the switch still has it from a previous connection
+        datapath.send_msg(parser.OFPGroupMod(datapath, ofproto.OFPGC_DELETE, ofproto.OFPGT_FF, group_id))
+        datapath.send_msg(parser.OFPGroupMod(datapath, ofproto.OFPGC_ADD, ofproto.OFPGT_FF, group_id, buckets))
+        installed[1].add(group_id)
+        return group_id
+
+    def get_flow_actions(self, datapath, in_port, src, dst, out_port):
+        """Get the actions of a flow sending packets to a port, through a fast failover group if it has a backup
+
+        Args:
+            datapath: The switch the flow is installed on
+            in_port: The input port of the flow
+            src: The source MAC address of the flow
+            dst: The destination MAC address of the flow
+            out_port: The output port of the flow
+
+        Returns:
+            The list of actions
+        """
+
+        entry = self.slice_table[datapath.id][in_port]
+        if self.fast_failover:
+            flow = self.failover_flows.get((datapath.id, in_port, src, dst))
+            if flow is not None and flow[0] == out_port and flow[1] is not None:
+                group_id = self.add_failover_group(datapath, out_port, flow[1])
+                return [datapath.ofproto_parser.OFPActionGroup(group_id)]
+        return entry.output_actions[out_port]
+
+    def install_proactive_flows(self):
+        """Install the flows between every pair of known hosts over the current slice
+
+        Used in proactive mode right after a slice is applied, so that the first packet of a
+        flow is forwarded by the switches without reaching the controller, and every time the
+        spanning tree or the hosts change, see schedule_proactive_update. Only the flows that
+        differ from the installed ones are added or deleted. The flows belong to the current
+        flow generation and are removed with the other ones on the next slice change.
+        """
+
+        cookie = self.flow_cookie | PROACTIVE_FLOW_COOKIE
+        if self.fast_failover:
+            # The backup paths are installed too, see compute_failover_flows
+            flows = self.failover_flows
+        else:
+            flows = {(dpid, in_port, src, dst): (out_port, None)
+                     for src, dst, hops in self.compute_slice_paths() for dpid, in_port, out_port in hops}
+
+        installed = {}
+        added = 0
+        for key, flow in flows.items():
+            dpid, in_port, src, dst = key
+            datapath = self.dpset.get(dpid)
+            if datapath is None:
+                continue
+            installed[key] = flow
+            if self.proactive_flows.get(key) == flow:
+                continue
+            match = datapath.ofproto_parser.OFPMatch(in_port=in_port, eth_src=src, eth_dst=dst)
+            actions = self.get_flow_actions(datapath, in_port, src, dst, flow[0])
+            self.add_flow(datapath, PROACTIVE_FLOW_PRIORITY, match, actions, cookie=cookie)
+            added += 1
+
+        deleted = 0
+        for dpid, in_port, src, dst in set(self.proactive_flows) - set(installed):
+            datapath = self.dpset.get(dpid)
+            if datapath is None:
+                continue
+            ofproto = datapath.ofproto
+            parser = datapath.ofproto_parser
+            datapath.send_msg(parser.OFPFlowMod(
+                datapath, cookie=cookie, cookie_mask=0xffffffffffffffff,
+                command=ofproto.OFPFC_DELETE_STRICT, table_id=1, priority=PROACTIVE_FLOW_PRIORITY,
+                out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY,
+                match=parser.OFPMatch(in_port=in_port, eth_src=src, eth_dst=dst)))
+            deleted += 1
+
+        self.proactive_flows = installed
+        self.logger.info("Installed %d proactive flows, deleted %d", added, deleted)
+
+    def get_port_states(self):
+        """Get whether each port of each switch is currently enabled in the spanning tree"""
+
+        return {dpid: {port_no: port.state != stplib.PORT_STATE_DISABLE
+                       for port_no, port in bridge.ports.items()}
+                for dpid, bridge in self.stp.bridge_list.items()}
+
+    def update_ports(self, target_ports=None, recalculate=False):
+        """Enable and disable the ports of the switches so that only the target ones are enabled
+
+        Only the ports whose state changes are touched, so that the spanning tree is not
+        recomputed on the parts of the network the transition does not affect. The changes of
+        a switch are applied as a single transaction, see stplib.Bridge.set_port_mask.
+
+        Args:
+            target_ports: The ports to have enabled, dpid -> set of port numbers,
+                None to have every port enabled
+            recalculate: Whether to recalculate the spanning tree of the switches with changes
+
+        Returns:
+            The changes applied, see slice_planner.plan_port_changes
+        """
+
+        changes = slice_planner.plan_port_changes(self.get_port_states(), target_ports)
+
+        for dpid, switch_changes in changes.items():
+            self.logger.info("[dpid=%s] Enabling ports %s, disabling ports %s",
+                             dpid_lib.dpid_to_str(dpid), switch_changes.enable, switch_changes.disable)
+            self.stp.bridge_list[dpid].set_port_mask(switch_changes.enable, switch_changes.disable, recalculate)
+
+        return changes
 
-        assert len(port_no_str) == _PORTNO_LEN
-        return int(port_no_str, 8)
-    
     def restore_topology(self):
         """Restore the topology of the network"""
 
         # Restore slice to port - every switch has all ports available
-        self.slice_to_port = self.no_slice_configuration
-
-        # Bring up all links
-        for switch in self.get_switches():
-            switch_id = dpid_lib.str_to_dpid(switch["dpid"])
-            bridge = self.stp.bridge_list[switch_id]
-            for port in switch["ports"]:
-                port = self.dpset.get_port(switch_id, self.str_to_port_no(port["port_no"]))
-                bridge.link_up(port)
+        self.set_slice(self.no_slice_configuration)
 
-        # Recalculate the spanning tree with the new topology
-        for bridge in self.stp.bridge_list.values():
-            bridge.recalculate_spanning_tree()
+        # Bring up the links disabled by the slice, recalculating the spanning tree of their switches
+        self.update_spanning_tree(None, recalculate=True)
 
     def update_topology_slice(self):
         """Update the topology of the network, applying the slice restrictions"""
 
-        def flatten(l):
-            """Flatten a list of lists to a single list"""
-            res = []
-            for item in l:
-                if type(item) is list:
-                    res.extend(item)
-                else:
-                    res.append(item)
-            return res
-        
-        # First enable ports based on the slice configuration
-        for switch in self.get_switches():
-            switch_id = dpid_lib.str_to_dpid(switch["dpid"])
-            bridge = self.stp.bridge_list[switch_id]
-            for port in switch["ports"]:
-                port_id = self.str_to_port_no(port["port_no"])
-                port = self.dpset.get_port(switch_id, port_id)
-                if not (port_id not in flatten(list(self.slice_to_port[str(switch_id)].values())) and str(port_id) not in list(self.slice_to_port[str(switch_id)].keys())):
-                    print("enabling port ("+str(port_id)+") on switch "+str(switch_id))
-                    bridge.link_up(port)
-        
-        # Then disable ports, based on the slice configuration
-        for switch in self.get_switches():
-            switch_id = dpid_lib.str_to_dpid(switch["dpid"])
-            bridge = self.stp.bridge_list[switch_id]
-            for port in switch["ports"]:
-                port_id = self.str_to_port_no(port["port_no"])
-                port = self.dpset.get_port(switch_id, port_id)
-                if port_id not in flatten(list(self.slice_to_port[str(switch_id)].values())) and str(port_id) not in list(self.slice_to_port[str(switch_id)].keys()):
-                    print("disabling port ("+str(port_id)+") on switch "+str(switch_id))
-                    bridge.link_down(port)
+        self.update_spanning_tree(slice_planner.slice_ports(self.slice_table))
+
+    def update_spanning_tree(self, target_ports=None, recalculate=False):
+        """Enable only the target ports, switching to the spanning tree already known for them if any
+
+        The spanning tree of the current ports is saved before leaving them, once it has
+        converged, so that moving back to a slice already applied restores its tree at once
+        instead of converging again. See stplib.Stp.save_tree.
+
+        When the target ports make no loop, and each of them has a known link or a host,
+        they are all put in forwarding state at once, see stplib.Stp.set_loop_free_tree.
+
+        Args:
+            target_ports: The ports to have enabled, dpid -> set of port numbers,
+                None to have every port enabled
+            recalculate: Whether to recalculate the spanning tree of the switches with changes,
+                when no tree is known for the target ports
+        """
+
+        self.stp.save_tree(self.spanning_tree_ports)
+        self.spanning_tree_ports = target_ports
+        if self.stp.restore_tree(target_ports):
+            self.logger.info("Restored the spanning tree of the slice")
+            return
+
+        # Without loop, every port of the slice can forward right away
+        if self.stp.set_loop_free_tree(self.get_link_ports(), target_ports):
+            self.logger.info("The slice has no loop, its ports forward right away")
+            return
+        self.update_ports(target_ports, recalculate)
+
+    def apply_slice(self, slice_index, progress=None):
+        """Apply the restrictions of a slice template to the network
+
+        Args:
+            slice_index: The index of the slice template
+            progress: Function called with the name of every phase started, see slice_jobs
+        """
+
+        progress = progress or (lambda phase: None)
+
+        # Set switch to slicing mode
+        self.slicing = True
+        try:
+            # Replace the queues and qos rules of the current slice with the ones of the new slice
+            progress("qos")
+            self.update_qos(self.current_slice_index, slice_index)
+
+            # Remove the flows learned with the previous slice
+            progress("flows")
+            self.flush_flows()
+
+            # Define the new slicing
+            self.set_slice(self.slice_templates[slice_index-1]["slice"], slice_index)
+            self.current_slice_index = slice_index
+
+            # Update the topology based on the updated slice
+            progress("topology")
+            self.update_topology_slice()
+
+            # Compute the backup paths of the flows between the known hosts
+            if self.fast_failover:
+                progress("failover")
+                self.failover_flows = self.compute_failover_flows()
+
+            # Install the complete flow set up front
+            if self.proactive:
+                progress("proactive_flows")
+                self.install_proactive_flows()
+        finally:
+            # Slice completed
+            self.slicing = False
+            self.replay_packet_ins()
+
+        print("current applied slice "+str(self.current_slice_index))
+        self.events_handler.send_slice_update(self.slice_to_port)
+
+    def remove_slice(self, progress=None):
+        """Remove the restrictions of the applied slice, if any, from the network
+
+        Args:
+            progress: Function called with the name of every phase started, see slice_jobs
+        """
+
+        progress = progress or (lambda phase: None)
+
+        self.slicing = True
+        try:
+            # If a slice is already applied, delete queues and qos rules
+            progress("qos")
+            self.update_qos(self.current_slice_index, None)
+
+            # Remove the flows learned with the previous slice
+            progress("flows")
+            self.flush_flows()
+
+            # Restore the topology - all ports are available
+            progress("topology")
+            self.restore_topology()
+
+            # Compute the backup paths of the flows between the known hosts
+            if self.fast_failover:
+                progress("failover")
+                self.failover_flows = self.compute_failover_flows()
+
+            # Install the complete flow set up front
+            if self.proactive:
+                progress("proactive_flows")
+                self.install_proactive_flows()
+
+            self.current_slice_index = None
+        finally:
+            self.slicing = False
+            self.replay_packet_ins()
+
+        self.events_handler.send_slice_update(self.slice_to_port)
+
+    def get_slice_template_index(self, template):
+        """Get the index of a slice template, found by identity since deleting a template shifts the next ones
+
+        Args:
+            template: The slice template, an element of slice_templates
+
+        Returns:
+            The index of the slice template
+
+        Raises:
+            ValueError: The slice template was deleted
+        """
+
+        for slice_index, candidate in enumerate(self.slice_templates, 1):
+            if candidate is template:
+                return slice_index
+        raise ValueError("The slice template %s was deleted" % template.get("name"))
+
+    def apply_slice_template(self, template, progress=None):
+        """Apply a slice template, wherever it is in slice_templates once the job runs, see apply_slice
+
+        Args:
+            template: The slice template, an element of slice_templates
+            progress: Function called with the name of every phase started, see slice_jobs
+        """
+
+        self.apply_slice(self.get_slice_template_index(template), progress)
+
+    def delete_slice_template(self, template, progress=None):
+        """Delete a slice template, deactivating it first if it is applied
+
+        Run as a job, after the jobs already submitted, so that the indexes of the slices
+        do not change while they are applied.
+
+        Args:
+            template: The slice template, an element of slice_templates
+            progress: Function called with the name of every phase started, see slice_jobs
+        """
+
+        progress = progress or (lambda phase: None)
+
+        slice_index = self.get_slice_template_index(template)
+        if self.current_slice_index and slice_index < self.current_slice_index:
+            self.logger.info("Deleting slice %d, the applied slice becomes %d",
+                             slice_index, self.current_slice_index - 1)
+            self.current_slice_index -= 1
+        elif self.current_slice_index and slice_index == self.current_slice_index:
+            self.logger.info("Deleting the applied slice %d, deactivating it first", slice_index)
+            self.remove_slice(progress)
+
+        # Delete the slice from the slice_templates and update the template file
+        progress("template")
+        del self.slice_templates[slice_index-1]
+        with open(utils.get_template_path(), "w") as outfile:
+            json.dump(self.slice_templates, outfile)
+        self.events_handler.send_slice_list_update(self.slice_templates)
 
 class SwitchController(ControllerBase):
     """Basic controller exposing the REST API"""
@@ -353,7 +1331,7 @@ class SwitchController(ControllerBase):
 
     @route('apply-slice', url + "/slice/{sliceid}", methods=['GET'], requirements={'sliceid': r'\d+'})
     def apply_slice(self, req, sliceid, **kwargs):
-        """Apply the slice restrictions to the network
+        """Apply the slice restrictions to the network, waiting for the activation to complete
         
         Args:
             req: The request object
@@ -362,107 +1340,79 @@ class SwitchController(ControllerBase):
         switch = self.switch_app
 
         # Check if the slice is valid
-        if len(switch.slice_templates) < int(sliceid):
+        if not 1 <= int(sliceid) <= len(switch.slice_templates):
             return Response(status=404)
-        
-        # Set switch to slicing mode
-        switch.slicing = True
-
-        # If a slice is already applied, delete queues and qos rules
-        if switch.current_slice_index is not None:
-            # Delete all QoS rules
-            res = requests.delete('http://localhost:8080/qos/rules/all/all', data=json.dumps({"rule_id": "all", "qos_id": "all"}))
-            print(res.text)
-            print("Finished delete all qos rules")
-
-            # Delete all queues
-            for qos_configuration in switch.slice_templates[int(switch.current_slice_index)-1]["qos"]:
-                res = requests.delete('http://localhost:8080/qos/queue/' + dpid_lib.dpid_to_str(qos_configuration['switch_id']))
-                print(res.text)
-                print("Finished deleting queue %s" % dpid_lib.dpid_to_str(qos_configuration['switch_id']))
-            
-            time.sleep(1)
-
-        # Set qos based on the new slice
-        for qos_configuration in switch.slice_templates[int(sliceid)-1]["qos"]:
-            print("Applying qos configuration: " + str(qos_configuration))
-            # Set the ovsdb_addr to the switch
-            requests.put('http://localhost:8080/v1.0/conf/switches/' + dpid_lib.dpid_to_str(qos_configuration['switch_id']) + '/ovsdb_addr', data='"tcp:127.0.0.1:6632"')
-
-            # Wait for the switch to be configured before applying the qos
-            time.sleep(0.3)
-
-            res = requests.post('http://localhost:8080/qos/queue/' + dpid_lib.dpid_to_str(qos_configuration['switch_id']), json.dumps({
-                "port_name": qos_configuration["port_name"],
-                "type": "linux-htb",
-                "max_rate": "10000000000",
-                "queues": [{"max_rate": queue["max_rate"]} for queue in qos_configuration["queues"]]
-            }))
-            print(res.text)
-
-            time.sleep(0.1)
-
-            for index, match in enumerate(qos_configuration["match"]):
-                res = requests.post('http://localhost:8080/qos/rules/' + dpid_lib.dpid_to_str(qos_configuration['switch_id']), json.dumps({
-                    "match": {
-                        "nw_dst": match["nw_dst"],
-                        "nw_src": match["nw_src"],
-                    },
-                    "actions": {
-                        "queue": qos_configuration["queues"][index]["queue"],
-                    }
-                }))
-                print(res.text)
-
-                time.sleep(0.1)
-
-        # Define the new slicing
-        switch.slice_to_port = switch.slice_templates[int(sliceid)-1]["slice"]
-        switch.current_slice_index = int(sliceid)
-        
-        # Update the topology based on the updated slice
-        switch.update_topology_slice()
-
-        # Slice completed
-        switch.slicing = False
 
-        print("current applied slice "+str(switch.current_slice_index))
-        switch.events_handler.send_slice_update(switch.slice_to_port)
+        template = switch.slice_templates[int(sliceid)-1]
+        job = switch.jobs.submit("activate", switch.apply_slice_template, template, slice_index=int(sliceid))
+        job.wait()
+        if job.status != slice_jobs.JOB_DONE:
+            return Response(status=500, content_type='application/json', text=json.dumps({"status": "ko", "error": job.error}))
         return Response(content_type='application/json', text=json.dumps({"status": "ok", "slice": sliceid}))
     
     @route('deactivate-slice', url + "/slice/deactivate", methods=['GET'])
     def deactivate_slice(self, req, **kwargs):
-        """Deactivate the slice restrictions to the network
+        """Deactivate the slice restrictions to the network, waiting for the deactivation to complete
         
         Args:
             req: The request object
         """
-
         switch = self.switch_app
-        switch.slicing = True
-
-        # If a slice is already applied, delete queues and qos rules
-        if switch.current_slice_index is not None:
-            # Delete all QoS rules
-            res = requests.delete('http://localhost:8080/qos/rules/all/all', data=json.dumps({"rule_id": "all", "qos_id": "all"}))
-            print(res.text)
-            print("Finished delete all qos rules")
-
-            # Delete all queues
-            for qos_configuration in switch.slice_templates[switch.current_slice_index-1]["qos"]:
-                res = requests.delete('http://localhost:8080/qos/queue/' + dpid_lib.dpid_to_str(qos_configuration['switch_id']))
-                print(res.text)
-                print("Finished deleting queue %s" % dpid_lib.dpid_to_str(qos_configuration['switch_id']))
-            
-            time.sleep(1)
 
-        # Restore the topology - all ports are available
-        switch.restore_topology()
-        switch.current_slice_index = None
-        
-        switch.slicing = False
-        switch.events_handler.send_slice_update(switch.slice_to_port)
+        job = switch.jobs.submit("deactivate", switch.remove_slice)
+        job.wait()
+        if job.status != slice_jobs.JOB_DONE:
+            return Response(status=500, content_type='application/json', text=json.dumps({"status": "ko", "error": job.error}))
         return Response(content_type='application/json', text=json.dumps({"status": "ok"}))
+
+    @route('submit-apply-slice', url + "/jobs/slice/{sliceid}", methods=['POST'], requirements={'sliceid': r'\d+'})
+    def submit_apply_slice(self, req, sliceid, **kwargs):
+        """Submit a job applying the slice restrictions to the network, without waiting for it
+
+        Args:
+            req: The request object
+            sliceid: The slice ID
+        """
+        switch = self.switch_app
+
+        # Check if the slice is valid
+        if not 1 <= int(sliceid) <= len(switch.slice_templates):
+            return Response(status=404)
+
+        template = switch.slice_templates[int(sliceid)-1]
+        job = switch.jobs.submit("activate", switch.apply_slice_template, template, slice_index=int(sliceid))
+        return Response(status=202, content_type='application/json', text=json.dumps({"status": "ok", "job": job.to_dict()}))
+
+    @route('submit-deactivate-slice', url + "/jobs/deactivate", methods=['POST'])
+    def submit_deactivate_slice(self, req, **kwargs):
+        """Submit a job deactivating the slice restrictions to the network, without waiting for it
+
+        Args:
+            req: The request object
+        """
+        switch = self.switch_app
+
+        job = switch.jobs.submit("deactivate", switch.remove_slice)
+        return Response(status=202, content_type='application/json', text=json.dumps({"status": "ok", "job": job.to_dict()}))
+
+    @route('get-jobs', url + "/jobs", methods=['GET'])
+    def get_jobs(self, req, **kwargs):
+        """Get the list of the slice activation jobs"""
+        jobs = [job.to_dict() for job in self.switch_app.jobs.jobs.values()]
+        return Response(content_type='application/json', text=json.dumps({"jobs": jobs}))
+
+    @route('get-job', url + "/jobs/{jobid}", methods=['GET'], requirements={'jobid': r'\d+'})
+    def get_job(self, req, jobid, **kwargs):
+        """Get the status of a slice activation job
+
+        Args:
+            req: The request object
+            jobid: The job ID
+        """
+        job = self.switch_app.jobs.get(int(jobid))
+        if job is None:
+            return Response(status=404)
+        return Response(content_type='application/json', text=json.dumps(job.to_dict()))
     
     @route('create-slice', url + "/slice", methods=['POST'])
     def create_slice(self, req, **kwargs):
@@ -505,18 +1455,11 @@ class SwitchController(ControllerBase):
         # Check if the slice is valid
         if len(switch.slice_templates) < int(sliceid) or int(sliceid)<5:
             return Response(status=404)
-        if switch.current_slice_index and int(sliceid) < switch.current_slice_index:
-            print("deleting slice with smaller id, new applied id will be "+str(switch.current_slice_index-1))
-            switch.current_slice_index-=1
-        elif switch.current_slice_index and int(sliceid)==switch.current_slice_index:
-            print("deleting currently applied slice, deactivating first "+str(switch.current_slice_index-1))
-            self.deactivate_slice(req,**kwargs)
-        # Delete the slice from the slice_templates
-        del switch.slice_templates[int(sliceid)-1]
-        
-        # Update the template file
-        with open(utils.get_template_path(), "w") as outfile:
-            json.dump(switch.slice_templates, outfile)
-        switch.events_handler.send_slice_list_update(switch.slice_templates)
 
+        # Deleted by a job, after the slices already submitted are applied
+        template = switch.slice_templates[int(sliceid)-1]
+        job = switch.jobs.submit("delete", switch.delete_slice_template, template, slice_index=int(sliceid))
+        job.wait()
+        if job.status != slice_jobs.JOB_DONE:
+            return Response(status=500, content_type='application/json', text=json.dumps({"status": "ko", "error": job.error}))
         return Response(content_type='application/json', text=json.dumps({"status": "ok", "slices": switch.slice_templates}))
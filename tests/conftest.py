@@ -0,0 +1,9 @@
+"""
+The modules of the application import each other as top-level modules (e.g. `import hub`),
+as ryu-manager runs them from the repository root: make the tests do the same.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,42 @@
+import pytest
+
+pytest.importorskip("ryu")
+
+from switch_stp_rest import (FLOW_COOKIE, FLOW_COOKIE_MASK, FLOW_GENERATION_COOKIE_MASK,
+                             LEARNED_FLOW_COOKIE_MASK, PROACTIVE_FLOW_COOKIE, make_flow_cookie)
+
+
+def _matches(cookie, flow_cookie, cookie_mask):
+    """Whether a flow is selected by a cookie and a mask, as the switches do it"""
+    return (flow_cookie & cookie_mask) == (cookie & cookie_mask)
+
+
+def test_flow_cookie_fields():
+    cookie = make_flow_cookie(3, 7)
+
+    assert cookie & FLOW_COOKIE_MASK == FLOW_COOKIE
+    assert not cookie & PROACTIVE_FLOW_COOKIE
+    assert (cookie >> 32) & 0x7fffff == 3
+    assert cookie & 0xffffffff == 7
+
+
+def test_flow_cookie_fields_do_not_overflow():
+    cookie = make_flow_cookie(1 << 23, 1 << 32)
+
+    assert cookie == FLOW_COOKIE
+
+
+def test_generation_mask_selects_learned_and_proactive_flows_of_a_generation():
+    cookie = make_flow_cookie(3, 7)
+
+    assert _matches(cookie, cookie, FLOW_GENERATION_COOKIE_MASK)
+    assert _matches(cookie, cookie | PROACTIVE_FLOW_COOKIE, FLOW_GENERATION_COOKIE_MASK)
+    assert not _matches(cookie, make_flow_cookie(3, 8), FLOW_GENERATION_COOKIE_MASK)
+    assert not _matches(cookie, make_flow_cookie(2, 7), FLOW_GENERATION_COOKIE_MASK)
+
+
+def test_learned_mask_leaves_out_proactive_flows():
+    assert _matches(FLOW_COOKIE, make_flow_cookie(3, 7), LEARNED_FLOW_COOKIE_MASK)
+    assert not _matches(FLOW_COOKIE, make_flow_cookie(3, 7) | PROACTIVE_FLOW_COOKIE,
+                        LEARNED_FLOW_COOKIE_MASK)
+
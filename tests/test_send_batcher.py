@@ -0,0 +1,61 @@
+import pytest
+
+pytest.importorskip("eventlet")
+
+import hub
+from send_batcher import SendBatcher
+
+
+class Datapath(object):
+    """Switch connection keeping the buffers written to it"""
+
+    def __init__(self):
+        self.send_q = []
+        self.written = []
+
+    def send(self, buf, close_socket=False):
+        if self.send_q is None:
+            return False
+        self.written.append((buf, close_socket))
+        return True
+
+
+def test_messages_of_a_hub_tick_are_written_at_once_in_order():
+    datapath = Datapath()
+    batcher = SendBatcher.install(datapath)
+
+    for buf in (b'a', b'b', b'c'):
+        assert datapath.send(buf)
+    assert datapath.written == []
+    hub.sleep(0)
+    datapath.send(b'd')
+    hub.sleep(0)
+
+    assert datapath.written == [(b'abc', False), (b'd', False)]
+    assert (batcher.messages, batcher.writes) == (4, 2)
+
+
+def test_install_is_done_once():
+    datapath = Datapath()
+
+    assert SendBatcher.install(datapath) is SendBatcher.install(datapath)
+
+
+def test_closing_message_is_written_after_the_queued_ones():
+    datapath = Datapath()
+    SendBatcher.install(datapath)
+
+    datapath.send(b'a')
+    datapath.send(b'b', close_socket=True)
+
+    assert datapath.written == [(b'a', False), (b'b', True)]
+
+
+def test_terminating_connection_is_not_batched():
+    datapath = Datapath()
+    SendBatcher.install(datapath)
+    datapath.send_q = None
+
+    assert not datapath.send(b'a')
+    hub.sleep(0)
+    assert datapath.written == []
@@ -0,0 +1,75 @@
+import pytest
+
+pytest.importorskip("eventlet")
+
+import slice_jobs
+
+
+@pytest.fixture
+def updates():
+    return []
+
+
+@pytest.fixture
+def jobs(updates):
+    manager = slice_jobs.JobManager(lambda job: updates.append((job.id, job.status, job.phase)))
+    yield manager
+    slice_jobs.hub.kill(manager._thread)
+
+
+def test_jobs_run_one_at_a_time_in_submission_order(jobs):
+    runs = []
+
+    def run(name, progress):
+        runs.append((name, 'start'))
+        progress('first')
+        slice_jobs.hub.sleep(0.01)
+        runs.append((name, 'end'))
+
+    first = jobs.submit('activate', run, 'a', slice_index=1)
+    second = jobs.submit('deactivate', run, 'b')
+
+    assert second.wait(1)
+    assert first.status == second.status == slice_jobs.JOB_DONE
+    assert runs == [('a', 'start'), ('a', 'end'), ('b', 'start'), ('b', 'end')]
+    assert first.to_dict()['slice'] == 1
+
+
+def test_job_phases_are_reported(jobs, updates):
+    def run(progress):
+        progress('qos')
+        progress('flows')
+
+    job = jobs.submit('activate', run)
+
+    assert job.wait(1)
+    assert updates == [(job.id, slice_jobs.JOB_PENDING, None),
+                       (job.id, slice_jobs.JOB_RUNNING, 'qos'),
+                       (job.id, slice_jobs.JOB_RUNNING, 'flows'),
+                       (job.id, slice_jobs.JOB_DONE, None)]
+    assert [phase['phase'] for phase in job.phases] == ['qos', 'flows']
+
+
+def test_failed_job_does_not_stop_the_next_ones(jobs):
+    def fail(progress):
+        raise ValueError('The slice template was deleted')
+
+    failed = jobs.submit('activate', fail)
+    done = jobs.submit('deactivate', lambda progress: None)
+
+    assert done.wait(1)
+    assert failed.status == slice_jobs.JOB_FAILED
+    assert failed.error == 'The slice template was deleted'
+    assert done.status == slice_jobs.JOB_DONE
+
+
+def test_only_the_last_finished_jobs_are_kept(jobs, monkeypatch):
+    monkeypatch.setattr(slice_jobs, 'MAX_JOBS', 2)
+
+    submitted = [jobs.submit('activate', lambda progress: None) for _ in range(3)]
+    assert submitted[-1].wait(1)
+    last = jobs.submit('activate', lambda progress: None)
+
+    # The pending job counts, but is never dropped
+    assert list(jobs.jobs) == [submitted[2].id, last.id]
+    assert jobs.get(submitted[0].id) is None
@@ -0,0 +1,62 @@
+import collections
+
+import slice_planner
+
+Entry = collections.namedtuple('Entry', ['out_ports'])
+
+
+def test_slice_ports_include_input_and_output_ports():
+    slice_table = {1: {1: Entry(frozenset([2])), 5: Entry(frozenset([1, 2]))},
+                   2: {}}
+
+    assert slice_planner.slice_ports(slice_table) == {1: {1, 2, 5}, 2: set()}
+
+
+def test_plan_port_changes_only_touches_differences():
+    port_states = {1: {1: True, 2: True, 3: False},
+                   2: {1: True, 2: False}}
+
+    changes = slice_planner.plan_port_changes(port_states, {1: {1, 3}, 2: {1}})
+
+    assert changes == {1: slice_planner.PortChanges([3], [2])}
+
+
+def test_plan_port_changes_enables_every_port_without_target():
+    port_states = {1: {1: False, 2: True}, 2: {1: True}}
+
+    changes = slice_planner.plan_port_changes(port_states)
+
+    assert changes == {1: slice_planner.PortChanges([1], [])}
+
+
+def test_plan_port_changes_disables_switches_missing_from_target():
+    port_states = {1: {2: True, 1: True}}
+
+    changes = slice_planner.plan_port_changes(port_states, {})
+
+    assert changes == {1: slice_planner.PortChanges([], [1, 2])}
+
+
+def _qos(port_name, rates, matches=()):
+    return {"port_name": port_name,
+            "queues": [{"max_rate": rate, "queue": index} for index, rate in enumerate(rates)],
+            "match": list(matches)}
+
+
+def test_plan_qos_changes_keeps_rules_when_only_rates_change():
+    match = {"nw_src": "10.0.0.1", "nw_dst": "10.0.0.2"}
+    old = {1: [_qos("s1-eth1", ["1000"], [match])]}
+    new = {1: [_qos("s1-eth1", ["2000"], [match])]}
+
+    changes = slice_planner.plan_qos_changes(old, new)
+
+    assert changes == {1: slice_planner.QoSChanges(old[1], new[1], True, False)}
+
+
+def test_plan_qos_changes_skips_identical_switches():
+    qos = {1: [_qos("s1-eth1", ["1000"])], 2: [_qos("s2-eth1", ["1000"])]}
+    new = {1: [_qos("s1-eth1", ["1000"])]}
+
+    changes = slice_planner.plan_qos_changes(qos, new)
+
+    assert changes == {2: slice_planner.QoSChanges(qos[2], [], True, False)}
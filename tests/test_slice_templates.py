@@ -0,0 +1,57 @@
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("ryu")
+
+import switch_stp_rest
+import utils
+
+
+@pytest.fixture
+def switch(tmp_path, monkeypatch):
+    """Switch application with six slice templates and no network"""
+    monkeypatch.setattr(utils, 'TEMPLATES_PATH', str(tmp_path / 'slice_templates.json'))
+    switch = switch_stp_rest.SimpleSwitch13.__new__(switch_stp_rest.SimpleSwitch13)
+    switch.logger = logging.getLogger('switch')
+    switch.slice_templates = [{"name": "slice %d" % index} for index in range(1, 7)]
+    switch.current_slice_index = None
+    switch.events_handler = SimpleNamespace(send_slice_list_update=lambda slice_list: None)
+    switch.applied = []
+    switch.apply_slice = lambda slice_index, progress=None: switch.applied.append(slice_index)
+
+    def remove_slice(progress=None):
+        switch.current_slice_index = None
+    switch.remove_slice = remove_slice
+    return switch
+
+
+def test_applied_template_is_found_after_a_deletion(switch):
+    template = switch.slice_templates[5]
+
+    switch.delete_slice_template(switch.slice_templates[4])
+    switch.apply_slice_template(template)
+
+    assert switch.applied == [5]
+
+
+def test_deleted_template_is_not_applied(switch):
+    template = switch.slice_templates[5]
+
+    switch.delete_slice_template(template)
+
+    with pytest.raises(ValueError):
+        switch.apply_slice_template(template)
+    assert switch.applied == []
+
+
+def test_deleting_a_template_keeps_the_applied_slice(switch):
+    switch.current_slice_index = 6
+
+    switch.delete_slice_template(switch.slice_templates[4])
+    assert switch.current_slice_index == 5
+
+    switch.delete_slice_template(switch.slice_templates[4])
+    assert switch.current_slice_index is None
+    assert [template["name"] for template in switch.slice_templates] == ["slice %d" % index for index in range(1, 5)]
@@ -0,0 +1,214 @@
+import logging
+
+import pytest
+
+pytest.importorskip("ryu")
+
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser
+
+import stplib
+
+
+class FakeDatapath(object):
+    """Switch with 'nports' 10 Gb/s ports, keeping the messages sent to it"""
+
+    def __init__(self, dpid, nports):
+        self.id = dpid
+        self.ofproto = ofproto_v1_3
+        self.ofproto_parser = ofproto_v1_3_parser
+        self.sent = []
+        self.ports = {
+            port_no: ofproto_v1_3_parser.OFPPort(
+                port_no, '00:00:00:00:%02x:%02x' % (dpid, port_no),
+                b's%d-eth%d' % (dpid, port_no), 0, 0,
+                ofproto_v1_3.OFPPF_10GB_FD, 0, 0, 0, 0, 0)
+            for port_no in range(1, nports + 1)}
+
+    def set_xid(self, msg):
+        return 0
+
+    def send_msg(self, msg):
+        self.sent.append(msg)
+
+    def send_packet_out(self, **kwargs):
+        self.sent.append(kwargs)
+
+
+@pytest.fixture
+def make_bridges():
+    """Build bridges of 'nports' ports, bridge 1 having the smallest bridge ID"""
+    scheduler = stplib.TimerScheduler()
+    bridges = {}
+
+    def make(dpids, nports, protocol=stplib.PROTOCOL_CENTRALIZED):
+        for dpid in dpids:
+            config = {'bridge': {'priority': 0x8000 + dpid * 0x1000,
+                                 'protocol': protocol}}
+            bridges[dpid] = stplib.Bridge(FakeDatapath(dpid, nports),
+                                          logging.getLogger('stplib'), config,
+                                          lambda ev: None, scheduler=scheduler)
+        return bridges
+
+    yield make
+    for bridge in bridges.values():
+        bridge.delete()
+    scheduler.stop()
+
+
+# Triangle of bridges 1, 2 and 3, port 3 of each bridge is free.
+TRIANGLE = {((1, 1), (2, 1)), ((2, 2), (3, 2)), ((3, 1), (1, 2))}
+
+
+def test_spanning_tree_blocks_one_port_of_a_triangle(make_bridges):
+    bridges = make_bridges([1, 2, 3], 3)
+
+    roles = stplib.compute_spanning_tree(bridges, TRIANGLE)
+
+    assert roles == {
+        1: {1: stplib.DESIGNATED_PORT, 2: stplib.DESIGNATED_PORT,
+            3: stplib.DESIGNATED_PORT},
+        2: {1: stplib.ROOT_PORT, 2: stplib.DESIGNATED_PORT,
+            3: stplib.DESIGNATED_PORT},
+        3: {1: stplib.ROOT_PORT, 2: stplib.ALTERNATE_PORT,
+            3: stplib.DESIGNATED_PORT}}
+
+
+def test_spanning_tree_ignores_disabled_ports(make_bridges):
+    bridges = make_bridges([1, 2, 3], 3)
+    bridges[1].ports[2].down(stplib.PORT_STATE_DISABLE, thread_switch=False)
+
+    roles = stplib.compute_spanning_tree(bridges, TRIANGLE)
+
+    assert 2 not in roles[1]
+    assert roles[3] == {1: stplib.DESIGNATED_PORT, 2: stplib.ROOT_PORT,
+                        3: stplib.DESIGNATED_PORT}
+
+
+def test_centralized_ports_without_known_link_listen(make_bridges):
+    bridges = make_bridges([1, 2, 3], 3)
+    roles = stplib.compute_spanning_tree(bridges, TRIANGLE)
+
+    for dpid, bridge in bridges.items():
+        linked_ports = {port_no for link in TRIANGLE
+                        for link_dpid, port_no in link if link_dpid == dpid}
+        bridge.set_port_roles(roles[dpid], linked_ports)
+
+    states = {dpid: {port_no: port.state for port_no, port in bridge.ports.items()}
+              for dpid, bridge in bridges.items()}
+    assert states == {
+        1: {1: stplib.PORT_STATE_FORWARD, 2: stplib.PORT_STATE_FORWARD,
+            3: stplib.PORT_STATE_LISTEN},
+        2: {1: stplib.PORT_STATE_FORWARD, 2: stplib.PORT_STATE_FORWARD,
+            3: stplib.PORT_STATE_LISTEN},
+        3: {1: stplib.PORT_STATE_FORWARD, 2: stplib.PORT_STATE_BLOCK,
+            3: stplib.PORT_STATE_LISTEN}}
+
+
+def test_centralized_edge_port_forwards_until_its_link_is_known(make_bridges):
+    bridges = make_bridges([1], 2)
+    port = bridges[1].ports[2]
+    bridges[1].set_port_roles({1: stplib.DESIGNATED_PORT,
+                               2: stplib.DESIGNATED_PORT})
+    assert port.state is stplib.PORT_STATE_LISTEN
+
+    port.set_edge()
+    assert port.state is stplib.PORT_STATE_FORWARD
+
+    # A link to a bridge is discovered on the port.
+    bridges[1].set_port_roles({1: stplib.DESIGNATED_PORT,
+                               2: stplib.ALTERNATE_PORT}, {2})
+    assert not port.edge
+    assert port.state is stplib.PORT_STATE_BLOCK
+
+
+@pytest.fixture
+def stp():
+    stp = stplib.Stp()
+    yield stp
+    stp.close()
+
+
+def test_saved_tree_is_restored_with_a_port_down(stp):
+    stp.set_config({dpid: {'bridge': {'priority': 0x8000 + dpid * 0x1000,
+                                      'protocol': stplib.PROTOCOL_CENTRALIZED}}
+                    for dpid in (1, 2, 3)})
+    for dpid in (1, 2, 3):
+        stp._register_bridge(FakeDatapath(dpid, 3))
+    stp.set_links(TRIANGLE)
+    for dpid in (1, 2, 3):
+        stp.set_edge_port(dpid, 3)
+    # The host of bridge 1 is unplugged.
+    stp.bridge_list[1].ports[3].down(stplib.PORT_STATE_DISABLE,
+                                     thread_switch=False)
+
+    assert stp.save_tree()
+    assert stp.restore_tree()
+    assert not stp.restore_tree({1: {1, 2}, 2: {1, 2}, 3: {1, 2}})
+
+
+def _tree_states(trees):
+    return {dpid: {port_no: (port.role, port.state)
+                   for port_no, port in tree.ports.items()}
+            for dpid, tree in trees.items()}
+
+
+def test_loop_free_tree_of_a_triangle_is_none(make_bridges):
+    bridges = make_bridges([1, 2, 3], 2)
+
+    assert stplib.compute_loop_free_tree(bridges, TRIANGLE) is None
+
+
+def test_loop_free_tree_forwards_every_enabled_port(make_bridges):
+    bridges = make_bridges([1, 2, 3], 2)
+    line = {((1, 1), (2, 1)), ((2, 2), (3, 2))}
+
+    trees = stplib.compute_loop_free_tree(bridges, line,
+                                          {1: {1}, 2: {1, 2}, 3: {2}})
+
+    forward = stplib.PORT_STATE_FORWARD
+    assert _tree_states(trees) == {
+        1: {1: (stplib.DESIGNATED_PORT, forward),
+            2: (stplib.DESIGNATED_PORT, stplib.PORT_STATE_DISABLE)},
+        2: {1: (stplib.ROOT_PORT, forward), 2: (stplib.DESIGNATED_PORT, forward)},
+        3: {1: (stplib.DESIGNATED_PORT, stplib.PORT_STATE_DISABLE),
+            2: (stplib.ROOT_PORT, forward)}}
+
+
+def test_loop_free_tree_needs_a_known_link_or_an_edge_port(make_bridges):
+    bridges = make_bridges([1, 2], 2, protocol=stplib.PROTOCOL_STP)
+    links = {((1, 1), (2, 1))}
+
+    assert stplib.compute_loop_free_tree(bridges, links) is None
+
+    bridges[1].ports[2].set_edge()
+    bridges[2].ports[2].set_edge()
+    trees = stplib.compute_loop_free_tree(bridges, links)
+    assert trees[2].ports[1] == (stplib.ROOT_PORT, stplib.PORT_STATE_FORWARD,
+                                 trees[2].root_priority, trees[2].root_times)
+    assert trees[1].ports[2].state is stplib.PORT_STATE_FORWARD
+
+
+def test_edge_port_going_down_raises_no_topology_change(make_bridges):
+    bridges = make_bridges([1], 2, protocol=stplib.PROTOCOL_STP)
+    port = bridges[1].ports[2]
+    port.set_edge()
+    notified = []
+    port.topology_change_notify = lambda *args: notified.append(args)
+
+    port.down(stplib.PORT_STATE_DISABLE, thread_switch=False)
+
+    assert notified == []
+    assert not port.edge
+
+
+def test_topology_change_flushes_other_ports_when_a_port_forwards(make_bridges):
+    bridge = make_bridges([1], 3)[1]
+    events = []
+    bridge.send_event = events.append
+
+    bridge.set_port_roles({1: stplib.DESIGNATED_PORT, 2: stplib.DESIGNATED_PORT,
+                           3: stplib.DESIGNATED_PORT}, {1})
+    bridge.ports[1].down(stplib.PORT_STATE_DISABLE, thread_switch=False)
+
+    assert [event.port_nos for event in events] == [frozenset([2, 3]),
+                                                   frozenset([1])]
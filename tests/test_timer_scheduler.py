@@ -0,0 +1,68 @@
+import pytest
+
+pytest.importorskip("eventlet")
+
+import hub
+from timer_scheduler import TimerScheduler
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = TimerScheduler()
+    yield scheduler
+    scheduler.stop()
+
+
+def test_timers_fire_in_deadline_order(scheduler):
+    fired = []
+
+    for delay, name in ((0.03, 'c'), (0.01, 'a'), (0.02, 'b'), (0.01, 'a2')):
+        scheduler.schedule(delay, lambda name=name: fired.append(name))
+    hub.sleep(0.06)
+
+    assert fired == ['a', 'a2', 'b', 'c']
+
+
+def test_earlier_timer_wakes_the_scheduler_up(scheduler):
+    fired = []
+
+    scheduler.schedule(10, lambda: fired.append('late'))
+    hub.sleep(0)
+    scheduler.schedule(0.01, lambda: fired.append('early'))
+    hub.sleep(0.05)
+
+    assert fired == ['early']
+
+
+def test_cancelled_timer_does_not_fire(scheduler):
+    fired = []
+
+    timer = scheduler.schedule(0.01, lambda: fired.append('cancelled'))
+    scheduler.schedule(0.02, lambda: fired.append('kept'))
+    timer.cancel()
+    hub.sleep(0.05)
+
+    assert fired == ['kept']
+
+
+def test_rescheduled_timer_fires_once_at_its_new_deadline(scheduler):
+    fired = []
+
+    timer = scheduler.schedule(0.01, lambda: fired.append('old'))
+    timer.cancel()
+    scheduler.schedule(0.03, lambda: fired.append('new'))
+    hub.sleep(0.02)
+    assert fired == []
+
+    hub.sleep(0.03)
+    assert fired == ['new']
+
+
+def test_failing_timer_does_not_stop_the_others(scheduler):
+    fired = []
+
+    scheduler.schedule(0.01, lambda: 1 / 0)
+    scheduler.schedule(0.02, lambda: fired.append('next'))
+    hub.sleep(0.05)
+
+    assert fired == ['next']
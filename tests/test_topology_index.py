@@ -0,0 +1,101 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("ryu")
+
+from ryu.ofproto import ofproto_v1_3_parser
+from ryu.topology.switches import Host, Link, Port, Switch
+
+from topology_index import TopologyIndex
+
+
+def _port(dpid, port_no):
+    ofpport = ofproto_v1_3_parser.OFPPort(port_no, '00:00:00:00:%02x:%02x' % (dpid, port_no),
+                                          b's%d-eth%d' % (dpid, port_no), 0, 0, 0, 0, 0, 0, 0, 0)
+    return Port(dpid, 4, ofpport)
+
+
+def _switch(dpid, port_nos):
+    switch = Switch(SimpleNamespace(id=dpid))
+    switch.ports = [_port(dpid, port_no) for port_no in port_nos]
+    return switch
+
+
+def _link(src, dst):
+    return Link(_port(*src), _port(*dst))
+
+
+def _network():
+    """Switches 1 and 2 linked by their port 1, with a host on port 2 of each"""
+    topology = TopologyIndex()
+    for dpid in (1, 2):
+        topology.switch_enter(_switch(dpid, [1, 2]))
+    topology.link_add(_link((1, 1), (2, 1)))
+    topology.link_add(_link((2, 1), (1, 1)))
+    topology.host_add(Host('00:00:00:00:00:01', _port(1, 2)))
+    topology.host_add(Host('00:00:00:00:00:02', _port(2, 2)))
+    return topology
+
+
+def test_links_and_hosts_are_indexed():
+    topology = _network()
+
+    assert topology.link_ports() == {(1, 1): (2, 1), (2, 1): (1, 1)}
+    assert topology.get_peer(1, 1) == (2, 1)
+    assert topology.get_peer(1, 2) is None
+    assert topology.host_ports() == {(1, 2): ['00:00:00:00:00:01'],
+                                     (2, 2): ['00:00:00:00:00:02']}
+
+
+def test_every_change_increases_the_version():
+    topology = _network()
+    version = topology.version
+
+    topology.link_delete(_link((1, 1), (2, 1)))
+    assert topology.version == version + 1
+
+    # Unknown link and host: nothing changes.
+    topology.link_delete(_link((1, 1), (2, 1)))
+    topology.host_delete(Host('00:00:00:00:00:03', _port(1, 2)))
+    assert topology.version == version + 1
+
+
+def test_host_moves_to_its_new_port():
+    topology = _network()
+
+    topology.host_add(Host('00:00:00:00:00:01', _port(2, 2)))
+
+    assert topology.get_port_hosts(1, 2) == []
+    assert topology.get_port_hosts(2, 2) == ['00:00:00:00:00:01', '00:00:00:00:00:02']
+    assert topology.get_host('00:00:00:00:00:01').port.dpid == 2
+
+
+def test_host_delete():
+    topology = _network()
+
+    topology.host_delete(Host('00:00:00:00:00:01', _port(1, 2)))
+
+    assert topology.get_host('00:00:00:00:00:01') is None
+    assert topology.host_ports() == {(2, 2): ['00:00:00:00:00:02']}
+
+
+def test_switch_leave_removes_its_links_and_hosts():
+    topology = _network()
+
+    topology.switch_leave(_switch(2, [1, 2]))
+
+    assert topology.link_ports() == {}
+    assert topology.host_ports() == {(1, 2): ['00:00:00:00:00:01']}
+    assert [switch['dpid'] for switch in topology.switches_to_dict()] == ['0000000000000001']
+
+
+def test_reconnected_switch_drops_the_links_and_hosts_of_its_missing_ports():
+    topology = _network()
+
+    # Switch 1 reconnects without its port 1.
+    topology.switch_enter(_switch(1, [2]))
+
+    assert topology.link_ports() == {}
+    assert topology.get_host('00:00:00:00:00:01') is not None
+    assert [port['port_no'] for port in topology.switches_to_dict()[0]['ports']] == ['00000002']
@@ -0,0 +1,93 @@
+"""
+Scheduler of the timers of the spanning tree ports.
+
+Every port of a bridge has a hello, a message age and a forward delay timer.
+Instead of a greenthread per timer, the TimerScheduler of an Stp runs the
+timers of all its ports from a single greenthread, waiting for the earliest
+deadline.
+"""
+
+import heapq
+import itertools
+import logging
+import time
+import hub
+
+
+class Timer(object):
+    """ A callback scheduled by TimerScheduler. """
+
+    def __init__(self, deadline, function):
+        super(Timer, self).__init__()
+        self.deadline = deadline
+        self.function = function
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerScheduler(object):
+    """ Run the STP timers (hello, message age, forward delay)
+         of every port from a single greenthread.
+
+         Timers are kept in a heap ordered by deadline, timers with the
+         same deadline fire in the order they were scheduled. A cancelled
+         timer stays in the heap and is dropped when it expires.
+
+         The callbacks of every port of every bridge run one after the
+         other in this greenthread: they must not block nor yield, e.g.
+         wait for a reply or sleep, or the timers of the other ports and
+         bridges are late as long. A port state change is made without
+         thread switching (see Port._state_timeout()), and the
+         recalculation of the spanning tree of a bridge is handed off to
+         its own greenthread (see Port._wait_bpdu_timeout()). The
+         messages sent by the callbacks are queued, they block only while
+         the send queue of a switch is full. """
+
+    def __init__(self, logger=None):
+        super(TimerScheduler, self).__init__()
+        self.logger = logger or logging.getLogger(__name__)
+        self.heap = []
+        self.seq = itertools.count()
+        self.event = hub.Event()
+        self.thread = None
+
+    def schedule(self, delay, function):
+        """ Call 'function' in 'delay' seconds, unless the returned
+             Timer is cancelled first. 'function' must not block. """
+        timer = Timer(time.monotonic() + delay, function)
+        heapq.heappush(self.heap, (timer.deadline, next(self.seq), timer))
+        if self.thread is None:
+            self.thread = hub.spawn(self._run)
+        elif self.heap[0][2] is timer:
+            # Wake up the thread to wait for the earlier deadline.
+            self.event.set()
+        return timer
+
+    def stop(self):
+        if self.thread is not None:
+            hub.kill(self.thread)
+            hub.joinall([self.thread])
+            self.thread = None
+        self.heap = []
+
+    def _run(self):
+        while True:
+            self.event.clear()
+            timeout = None
+            if self.heap:
+                timeout = max(self.heap[0][0] - time.monotonic(), 0)
+            if timeout is None or timeout > 0:
+                self.event.wait(timeout)
+            now = time.monotonic()
+            while self.heap and self.heap[0][0] <= now:
+                timer = heapq.heappop(self.heap)[2]
+                if timer.cancelled:
+                    continue
+                timer.cancelled = True
+                try:
+                    timer.function()
+                except Exception:
+                    self.logger.exception('STP timer failed.',
+                                          extra={'dpid': '-'})
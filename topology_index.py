@@ -0,0 +1,172 @@
+"""
+In-process index of the topology discovered by ryu.topology.
+
+The switches, hosts and links are kept up to date from the ryu.topology events
+(switches entering and leaving, ports, links, hosts), instead of being fetched
+from the REST API of rest_topology running in the same process. Lookups by
+dpid, port or MAC address are dictionary accesses, and the version of the index
+is increased at every change, so that what is computed from the topology can be
+reused until it changes.
+"""
+
+from ryu.lib import dpid as dpid_lib
+
+
+class TopologyIndex(object):
+    """Switches, links and hosts of the network, updated from the ryu.topology events"""
+
+    def __init__(self):
+        super(TopologyIndex, self).__init__()
+        self.version = 0
+        """Number of changes of the topology so far"""
+        self._ports = {}
+        """Ports of each switch, dpid -> port number -> ryu.topology.switches.Port"""
+        self._links = {}
+        """Links by the (dpid, port_no) of their source, as ryu.topology.switches.Link"""
+        self._hosts = {}
+        """Hosts by MAC address, as ryu.topology.switches.Host"""
+        self._port_hosts = {}
+        """MAC addresses of the hosts attached to each (dpid, port_no)"""
+
+    def _changed(self):
+        self.version += 1
+
+    def switch_enter(self, switch):
+        """Add a switch and its ports, or update a switch that reconnected
+
+        The links and hosts of the ports the switch no longer has are removed.
+
+        Args:
+            switch: The ryu.topology.switches.Switch
+        """
+        dpid = switch.dp.id
+        old_ports = self._ports.get(dpid, {})
+        self._ports[dpid] = {port.port_no: port for port in switch.ports}
+        for port_no in set(old_ports) - set(self._ports[dpid]):
+            self._remove_port(dpid, port_no)
+        self._changed()
+
+    def switch_leave(self, switch):
+        """Remove a switch, with its links and hosts
+
+        Args:
+            switch: The ryu.topology.switches.Switch
+        """
+        dpid = switch.dp.id
+        self._ports.pop(dpid, None)
+        for src, link in list(self._links.items()):
+            if src[0] == dpid or link.dst.dpid == dpid:
+                del self._links[src]
+        for port in [port for port in self._port_hosts if port[0] == dpid]:
+            for mac in self._port_hosts.pop(port):
+                del self._hosts[mac]
+        self._changed()
+
+    def port_add(self, port):
+        """Add or update a port of a switch
+
+        Args:
+            port: The ryu.topology.switches.Port
+        """
+        self._ports.setdefault(port.dpid, {})[port.port_no] = port
+        self._changed()
+
+    def port_delete(self, port):
+        """Remove a port of a switch, with its links and hosts
+
+        Args:
+            port: The ryu.topology.switches.Port
+        """
+        self._ports.get(port.dpid, {}).pop(port.port_no, None)
+        self._remove_port(port.dpid, port.port_no)
+        self._changed()
+
+    def _remove_port(self, dpid, port_no):
+        """Remove the links and hosts of a port"""
+        key = (dpid, port_no)
+        self._links.pop(key, None)
+        for src, link in list(self._links.items()):
+            if (link.dst.dpid, link.dst.port_no) == key:
+                del self._links[src]
+        for mac in self._port_hosts.pop(key, ()):
+            del self._hosts[mac]
+
+    def link_add(self, link):
+        """Add a unidirectional link
+
+        Args:
+            link: The ryu.topology.switches.Link
+        """
+        self._links[(link.src.dpid, link.src.port_no)] = link
+        self._changed()
+
+    def link_delete(self, link):
+        """Remove a unidirectional link
+
+        Args:
+            link: The ryu.topology.switches.Link
+        """
+        if self._links.pop((link.src.dpid, link.src.port_no), None) is not None:
+            self._changed()
+
+    def host_add(self, host):
+        """Add a host, or move it to its new port
+
+        Args:
+            host: The ryu.topology.switches.Host
+        """
+        self.host_delete(host)
+        self._hosts[host.mac] = host
+        self._port_hosts.setdefault((host.port.dpid, host.port.port_no), set()).add(host.mac)
+        self._changed()
+
+    def host_delete(self, host):
+        """Remove a host
+
+        Args:
+            host: The ryu.topology.switches.Host
+        """
+        old = self._hosts.pop(host.mac, None)
+        if old is None:
+            return
+        port = (old.port.dpid, old.port.port_no)
+        macs = self._port_hosts[port]
+        macs.discard(host.mac)
+        if not macs:
+            del self._port_hosts[port]
+        self._changed()
+
+    def get_peer(self, dpid, port_no):
+        """Get the (dpid, port_no) at the other end of the link of a port, None if it has no link"""
+        link = self._links.get((dpid, port_no))
+        return (link.dst.dpid, link.dst.port_no) if link is not None else None
+
+    def get_host(self, mac):
+        """Get the host with a MAC address, None if unknown"""
+        return self._hosts.get(mac)
+
+    def get_port_hosts(self, dpid, port_no):
+        """Get the MAC addresses of the hosts attached to a port"""
+        return sorted(self._port_hosts.get((dpid, port_no), ()))
+
+    def link_ports(self):
+        """Get the links as a dictionary (dpid, port_no) of the source -> (dpid, port_no) of the destination"""
+        return {src: (link.dst.dpid, link.dst.port_no) for src, link in self._links.items()}
+
+    def host_ports(self):
+        """Get the hosts as a dictionary (dpid, port_no) -> sorted list of MAC addresses"""
+        return {port: sorted(macs) for port, macs in self._port_hosts.items()}
+
+    def switches_to_dict(self):
+        """Get the switches in the format of rest_topology"""
+        return [{"dpid": dpid_lib.dpid_to_str(dpid),
+                 "ports": [ports[port_no].to_dict() for port_no in sorted(ports)]}
+                for dpid, ports in sorted(self._ports.items())]
+
+    def hosts_to_dict(self):
+        """Get the hosts in the format of rest_topology"""
+        return [host.to_dict() for _, host in sorted(self._hosts.items())]
+
+    def links_to_dict(self):
+        """Get the links in the format of rest_topology"""
+        return [link.to_dict() for _, link in sorted(self._links.items())]
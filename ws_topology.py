@@ -47,6 +47,11 @@ class WebSocketTopology(app_manager.RyuApp):
         """Slice update event handler"""
         self._rpc_broadcall('event_slice_list_update', ev.slice_list)
 
+    @set_ev_cls(custom_events.JobProgressEvent)
+    def _event_job_progress(self, ev):
+        """Job progress event handler"""
+        self._rpc_broadcall('event_job_progress', ev.job)
+
 
     @set_ev_cls(event.EventSwitchLeave)
     def _event_switch_leave_handler(self, ev):